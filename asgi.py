@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+RuneQuestRPG ASGI entry point
+
+Serves the web app and runs the Telegram bot's polling on one event loop:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+For several workers pass the count as WEB_CONCURRENCY (uvicorn reads it as
+--workers), which also turns on the cache bus the workers need to share one
+database (see CACHE_BUS in webapp_bot.py).
+
+Hot reads (/api/player, /api/leaderboard) are answered on the loop from the
+in-process caches, falling back to aiosqlite on a cache miss (or to the
+backend's connection pool when DATABASE_URL points at a server). Every
+other route runs the Flask app on a bounded thread pool, so slow handlers
+never block the loop and idle connections cost no threads. Needs the
+packages in requirements-asgi.txt.
+"""
+
+import asyncio
+import io
+import math
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+from urllib.parse import parse_qs
+
+import aiosqlite
+
+from webapp_bot import (
+    CHILD_TABLES, DB_BUSY_TIMEOUT_MS, PLAYER_COLUMNS, RATE_LIMIT_ENABLED, CombatSystem, Database,
+    Leaderboard, Player, SQLiteDialect, app as flask_app, auction_house, battle_log, build_bot_application,
+    json_encode, logger, metrics, parse_user_id, player_cache, quest_engine, rankings, rate_limiter,
+)
+
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", "32"))
+TELEGRAM_POLLING = os.getenv("TELEGRAM_POLLING", "1") == "1"
+
+
+class AsyncDatabase:
+    """Read path over a single aiosqlite connection, or the sync backend when `path` is None."""
+
+    def __init__(self, path: Optional[str], executor: ThreadPoolExecutor):
+        self.path = path
+        self.executor = executor
+        self.conn: Optional[aiosqlite.Connection] = None
+        self._loading: Dict[int, asyncio.Future] = {}
+
+    async def connect(self):
+        if self.path is None:
+            return
+        self.conn = await aiosqlite.connect(self.path, timeout=DB_BUSY_TIMEOUT_MS / 1000)
+        self.conn.row_factory = sqlite3.Row
+        await self.conn.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}')
+
+    async def close(self):
+        if self.conn is not None:
+            await self.conn.close()
+
+    async def load_player(self, user_id: int) -> Optional[Player]:
+        if self.conn is None:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, Database.load_player, user_id)
+        async with self.conn.execute(
+            f'SELECT {", ".join(PLAYER_COLUMNS)}, normalized FROM players WHERE user_id = ?', (user_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+        if not row:
+            return None
+        if not row['normalized']:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, Database.load_player, user_id)
+
+        children = {}
+        for table in CHILD_TABLES:
+            async with self.conn.execute(
+                f'SELECT {table.key}, {", ".join(table.names)} FROM {table.table} WHERE user_id = ?', (user_id,)
+            ) as cursor:
+                children[table.field] = table.to_mapping(await cursor.fetchall())
+        return Player.from_row(row, children)
+
+    async def load_player_once(self, user_id: int) -> Optional[Player]:
+        """load_player shared by concurrent cache misses for the same user."""
+        future = self._loading.get(user_id)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = self._loading[user_id] = asyncio.ensure_future(self.load_player(user_id))
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if self._loading.get(user_id) is future:
+                del self._loading[user_id]
+
+    @staticmethod
+    def cached_player(user_id: int, loaded: Optional[Player] = None) -> Optional[Player]:
+        """Cache lookup (storing `loaded` first) plus the daily quest reset.
+
+        Storing can flush an evicted player and the save may write through,
+        so this runs on the thread pool, never on the loop.
+        """
+        player = player_cache.get(user_id) if loaded is None else player_cache.put(user_id, loaded)
+        if player is not None and quest_engine.refresh(player):
+            Database.save_player(user_id, player)
+        return player
+
+    async def get_player(self, user_id: int) -> Optional[Player]:
+        loop = asyncio.get_running_loop()
+        player = await loop.run_in_executor(self.executor, self.cached_player, user_id)
+        if player is None:
+            loaded = await self.load_player_once(user_id)
+            if loaded is None:
+                return None
+            player = await loop.run_in_executor(self.executor, self.cached_player, user_id, loaded)
+        return player
+
+
+class RuneQuestASGI:
+    def __init__(self, wsgi_app, threads: int):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+        backend = Database.backend
+        self.db = AsyncDatabase(backend.path if isinstance(backend, SQLiteDialect) else None, self.executor)
+        self.bot = None
+        self.routes = {
+            '/api/player': self.get_player,
+            '/api/leaderboard': self.get_leaderboard,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        handler = self.routes.get(scope['path']) if scope['method'] == 'GET' else None
+        if handler is not None:
+            start = time.perf_counter()
+            query = {key: values[-1] for key, values in parse_qs(scope['query_string'].decode('latin-1')).items()}
+            status, payload, *headers = await handler(query)
+            await self.send_json(send, status, payload, *headers)
+            if metrics.enabled:
+                metrics.record_request(scope['path'], 'GET', status, time.perf_counter() - start)
+            return
+        await self.call_wsgi(scope, receive, send)
+
+    # ----- native async handlers -----
+
+    @staticmethod
+    def int_arg(query: Dict[str, str], name: str, default: Optional[int] = None) -> Optional[int]:
+        try:
+            return int(query[name])
+        except (KeyError, ValueError):
+            return default
+
+    async def get_player(self, query):
+        raw_user_id = query.get('user_id')
+        user_id = parse_user_id(raw_user_id)
+        if raw_user_id is not None and user_id is None:
+            return 400, {'error': 'Invalid user_id'}
+        if not user_id:
+            return 400, {'error': 'Missing user_id'}
+        if RATE_LIMIT_ENABLED:
+            allowed, retry_after = rate_limiter.allow(user_id, '/api/player')
+            if not allowed:
+                return 429, {'error': 'Too many requests'}, [(b'retry-after', str(math.ceil(retry_after)).encode())]
+        player = await self.db.get_player(user_id)
+        if not player:
+            return 404, {'error': 'Player not found'}
+        return 200, CombatSystem.apply_equipment_bonuses(player)
+
+    async def get_leaderboard(self, query):
+        board = query.get('board', 'level')
+        if board not in Leaderboard.BOARDS:
+            return 400, {'error': 'Invalid board'}
+        offset = max(0, self.int_arg(query, 'offset', 0))
+        limit = min(100, max(1, self.int_arg(query, 'limit', 50)))
+        if rankings.loaded:
+            return 200, rankings.page(board, offset, limit)
+        # The first read after startup or a reload rebuilds from the database
+        page = await asyncio.get_running_loop().run_in_executor(self.executor, rankings.page, board, offset, limit)
+        return 200, page
+
+    @staticmethod
+    async def send_json(send, status: int, payload, headers=()):
+        body = json_encode(payload)
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                        *headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    # ----- Flask bridge -----
+
+    def wsgi_environ(self, scope, body: bytes) -> Dict:
+        server_name, server_port = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': str(server_port),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'CONTENT_LENGTH': str(len(body)),
+        }
+        for name, value in scope['headers']:
+            key = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if key == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif key != 'CONTENT_LENGTH':
+                key = f'HTTP_{key}'
+                environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+    def run_wsgi(self, environ):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], body
+
+    async def call_wsgi(self, scope, receive, send):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        environ = self.wsgi_environ(scope, b''.join(chunks))
+        loop = asyncio.get_running_loop()
+        status, headers, body = await loop.run_in_executor(self.executor, self.run_wsgi, environ)
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    # ----- lifespan -----
+
+    async def startup(self):
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(self.executor)
+        await self.db.connect()
+        await loop.run_in_executor(self.executor, rankings.size)
+        auction_house.start()
+        if TELEGRAM_POLLING:
+            try:
+                self.bot = build_bot_application()
+                await self.bot.initialize()
+                await self.bot.start()
+                await self.bot.updater.start_polling()
+                logger.info("Telegram bot polling on the ASGI event loop")
+            except Exception as e:
+                logger.error(f"Telegram bot failed to start: {e}")
+                self.bot = None
+
+    async def shutdown(self):
+        if self.bot is not None:
+            await self.bot.updater.stop()
+            await self.bot.stop()
+            await self.bot.shutdown()
+        await self.db.close()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, player_cache.shutdown)
+        await loop.run_in_executor(self.executor, battle_log.shutdown)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = RuneQuestASGI(flask_app, ASGI_THREADS)
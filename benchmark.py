@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""
+RuneQuestRPG API benchmark
+
+Seeds a throwaway database with synthetic players, drives realistic play
+sessions (create, player, attacks, battle-end, buy-item, leaderboard)
+through Flask's test client or a running server, and reports throughput
+and p50/p95/p99 latency per endpoint, followed by micro-benchmarks of the
+hot server functions:
+
+    python benchmark.py --players 100000 --sessions 2000 --threads 4
+    python benchmark.py --url http://localhost:5000 --sessions 500
+    python benchmark.py --save-baseline bench.json
+    python benchmark.py --compare bench.json --tolerance 0.2
+
+With --compare, endpoints or functions whose p95 latency or throughput got
+worse than the baseline by more than the tolerance are flagged and the exit
+status is 1.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from datetime import date, datetime
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SEED_CHUNK = 10000
+
+
+def load_app(workdir: str):
+    """Import webapp_bot with its database inside `workdir`."""
+    os.environ.setdefault("BOT_TOKEN", "benchmark")
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+    os.environ["DATABASE_PATH"] = os.path.join(workdir, "runequestrpg.db")
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    import webapp_bot
+    return webapp_bot
+
+
+def seed_players(bot, count: int, seed: int = 0) -> list:
+    """Bulk-insert `count` players with spread-out levels, gold, kills and gear."""
+    rng = random.Random(seed)
+    classes = list(bot.CLASSES)
+    quests = bot.CHILD_TABLES[-1]
+    equipment = bot.CHILD_TABLES[1]
+    slots = defaultdict(list)
+    for item_id, item in bot.ITEM_INDEX.items():
+        if item['slot']:
+            slots[item['slot']].append(item_id)
+    today = date.today().isoformat()
+    now = datetime.now().isoformat()
+
+    user_ids = [1_000_000 + i for i in range(count)]
+    for offset in range(0, count, SEED_CHUNK):
+        players, quest_rows, gear_rows = [], [], []
+        for user_id in user_ids[offset:offset + SEED_CHUNK]:
+            class_type = classes[user_id % len(classes)]
+            cls = bot.CLASSES[class_type]
+            level = min(bot.MAX_LEVEL, 1 + int(rng.expovariate(0.15)))
+            stats = bot.progression.stats(class_type, level)
+            players.append((
+                user_id, f'bench_{user_id}', class_type, level, rng.randrange(bot.LEVEL_UP_EXP * level),
+                stats['max_health'], stats['max_health'], stats['max_mana'], stats['max_mana'],
+                stats['attack'], stats['defense'], cls['crit_chance'], cls['dodge_chance'], cls['crit_damage'],
+                cls['starting_gold'] + rng.randrange(5000), rng.randrange(level * 20),
+                bot.progression.thresholds[level - 1], rng.randrange(level * 2000), today, now, now,
+            ))
+            quest_rows.extend((user_id, quest_id, 0, 0) for quest_id in bot.DAILY_QUESTS)
+            if rng.random() < 0.5:
+                gear_rows.extend((user_id, slot, rng.choice(items)) for slot, items in slots.items())
+        with bot.Database.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO players (user_id, username, class_type, level, exp, health, max_health, mana, max_mana,
+                                   attack, defense, crit_chance, dodge_chance, crit_damage, gold, kills,
+                                   total_exp, damage_dealt, normalized, quests_date, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?, ?)
+            ''', players)
+            conn.executemany(
+                f'INSERT INTO {quests.table} (user_id, {quests.key}, {", ".join(quests.names)}) VALUES (?, ?, ?, ?)',
+                quest_rows
+            )
+            conn.executemany(
+                f'INSERT INTO {equipment.table} (user_id, {equipment.key}, {equipment.names[0]}) VALUES (?, ?, ?)',
+                gear_rows
+            )
+    bot.rankings.reload()
+    return user_ids
+
+
+# ===================== TRANSPORTS =====================
+
+class TestClientTransport:
+    """Requests through Flask's in-process test client."""
+
+    def __init__(self, bot):
+        self.client = bot.app.test_client()
+
+    def get(self, path: str):
+        res = self.client.get(path)
+        return res.status_code, res.get_json(silent=True)
+
+    def post(self, path: str, payload: dict):
+        res = self.client.post(path, json=payload)
+        return res.status_code, res.get_json(silent=True)
+
+
+class HttpTransport:
+    """Requests over HTTP to a running server."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip('/')
+
+    def _send(self, req):
+        try:
+            with urllib.request.urlopen(req, timeout=30) as res:
+                return res.status, json.loads(res.read() or b'null')
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            try:
+                return e.code, json.loads(body or b'null')
+            except ValueError:
+                return e.code, None
+
+    def get(self, path: str):
+        return self._send(urllib.request.Request(self.base_url + path))
+
+    def post(self, path: str, payload: dict):
+        return self._send(urllib.request.Request(
+            self.base_url + path, data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, method='POST',
+        ))
+
+
+# ===================== SESSIONS =====================
+
+class Recorder:
+    """Per-endpoint latency samples and error counts, merged across threads."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def merge(self, samples: dict, errors: dict):
+        with self._lock:
+            for name, values in samples.items():
+                self.samples[name].extend(values)
+            for name, count in errors.items():
+                self.errors[name] += count
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    values = sorted(samples)
+    return {
+        'count': len(values),
+        'rps': len(values) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(values, 50) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+    }
+
+
+def play_session(transport, rng: random.Random, user_id: int, create: bool, classes: list,
+                 enemies: list, samples: dict, errors: dict):
+    def call(name, method, path, payload=None):
+        start = time.perf_counter()
+        status, body = transport.get(path) if method == 'GET' else transport.post(path, payload)
+        samples[name].append(time.perf_counter() - start)
+        if status >= 500:
+            errors[name] += 1
+        return status, body or {}
+
+    if create:
+        call('create', 'POST', '/api/create',
+             {'user_id': user_id, 'class': rng.choice(classes), 'username': f'session_{user_id}'})
+    call('player', 'GET', f'/api/player?user_id={user_id}')
+    for _ in range(rng.randint(1, 3)):
+        status, body = call('battle-start', 'POST', '/api/battle-start', {'user_id': user_id, 'enemy_id': rng.choice(enemies)})
+        if status != 200:
+            break
+        for _ in range(200):
+            is_skill = body.get('skill_ready', False) and rng.random() < 0.2
+            status, body = call('attack', 'POST', '/api/attack', {'user_id': user_id, 'is_skill': is_skill})
+            if status != 200 or body.get('finished', True):
+                break
+        call('battle-end', 'POST', '/api/battle-end', {'user_id': user_id})
+    call('buy-item', 'POST', '/api/buy-item', {'user_id': user_id, 'item_id': 'health_potion'})
+    call('leaderboard', 'GET', f'/api/leaderboard?board={rng.choice(["level", "kills", "gold"])}&limit=50')
+
+
+def run_sessions(make_transport, user_ids: list, sessions: int, threads: int, create_ratio: float,
+                 classes: list, enemies: list, seed: int) -> dict:
+    recorder = Recorder()
+    next_id = iter(range(5_000_000, 5_000_000 + sessions))
+    id_lock = threading.Lock()
+    per_thread = max(1, sessions // threads)
+
+    def worker(index: int):
+        rng = random.Random(seed + index)
+        transport = make_transport()
+        samples, errors = defaultdict(list), defaultdict(int)
+        for _ in range(per_thread):
+            create = not user_ids or rng.random() < create_ratio
+            if create:
+                with id_lock:
+                    user_id = next(next_id)
+            else:
+                user_id = rng.choice(user_ids)
+            play_session(transport, rng, user_id, create, classes, enemies, samples, errors)
+        recorder.merge(samples, errors)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+
+    results = {name: {**summarize(values, elapsed), 'errors': recorder.errors[name]}
+               for name, values in sorted(recorder.samples.items())}
+    results['all'] = {**summarize([v for values in recorder.samples.values() for v in values], elapsed),
+                      'errors': sum(recorder.errors.values())}
+    return results
+
+
+# ===================== MICRO-BENCHMARKS =====================
+
+def time_calls(func, args_list: list) -> dict:
+    timings = []
+    start = time.perf_counter()
+    for args in args_list:
+        t0 = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - t0)
+    return summarize(timings, time.perf_counter() - start)
+
+
+def run_micro(bot, user_ids: list, iterations: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    picks = [rng.choice(user_ids) for _ in range(iterations)]
+    results = {}
+
+    bot.player_cache.flush()
+    cold = list(dict.fromkeys(picks))
+    for user_id in cold:
+        bot.player_cache.invalidate(user_id)
+    results['get_player (miss)'] = time_calls(bot.Database.get_player, [(u,) for u in cold])
+    results['get_player (hit)'] = time_calls(bot.Database.get_player, [(u,) for u in picks])
+
+    players = [(u, bot.Database.get_player(u)) for u in picks]
+    for _, player in players:
+        player['damage_dealt'] += 1
+    results['save_player'] = time_calls(bot.Database.save_player, players)
+    bot.player_cache.flush()
+
+    results['apply_equipment_bonuses'] = time_calls(
+        bot.CombatSystem.apply_equipment_bonuses, [(player,) for _, player in players]
+    )
+    boards = list(bot.Leaderboard.BOARDS)
+    results['get_leaderboard'] = time_calls(
+        bot.Database.get_leaderboard,
+        [(50, rng.choice(boards), rng.randrange(0, max(1, len(user_ids) - 50))) for _ in range(iterations)]
+    )
+    return results
+
+
+# ===================== REPORTING =====================
+
+def print_table(title: str, results: dict):
+    print(f"\n{title}")
+    print(f"{'name':<26} {'count':>8} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for name, r in results.items():
+        print(f"{name:<26} {r['count']:>8} {r['rps']:>10.1f} {r['p50_ms']:>9.3f} {r['p95_ms']:>9.3f} "
+              f"{r['p99_ms']:>9.3f} {r.get('errors', 0):>7}")
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Names whose p95 or throughput regressed beyond `tolerance` versus the baseline."""
+    regressions = []
+    for section in ('endpoints', 'micro'):
+        for name, current in report.get(section, {}).items():
+            base = baseline.get(section, {}).get(name)
+            if not base or not base['count'] or not current['count']:
+                continue
+            if current['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{section}/{name}: p95 {base['p95_ms']:.3f}ms -> {current['p95_ms']:.3f}ms")
+            if current['rps'] < base['rps'] * (1 - tolerance):
+                regressions.append(f"{section}/{name}: {base['rps']:.1f} -> {current['rps']:.1f} ops/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the RuneQuestRPG HTTP API")
+    parser.add_argument("--players", type=int, default=10000, help="synthetic players to seed")
+    parser.add_argument("--sessions", type=int, default=1000, help="play sessions across all threads")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--create-ratio", type=float, default=0.1, help="share of sessions that create a new player")
+    parser.add_argument("--micro", type=int, default=5000, help="calls per micro-benchmark (0 to skip)")
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process test client")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", metavar="PATH", help="write results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="flag regressions against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown before flagging")
+    args = parser.parse_args()
+    for name in ('save_baseline', 'compare'):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = load_app(workdir)
+        classes, enemies = list(bot.CLASSES), list(bot.ENEMIES)
+        config = {'players': args.players, 'sessions': args.sessions, 'threads': args.threads,
+                  'create_ratio': args.create_ratio, 'target': args.url or 'test-client'}
+        print(' '.join(f'{key}={value}' for key, value in config.items()))
+
+        user_ids = []
+        if args.url:
+            make_transport = lambda: HttpTransport(args.url)  # noqa: E731
+        else:
+            start = time.perf_counter()
+            user_ids = seed_players(bot, args.players, args.seed)
+            print(f"seeded {len(user_ids):,} players in {time.perf_counter() - start:.1f}s")
+            make_transport = lambda: TestClientTransport(bot)  # noqa: E731
+
+        report = {'config': config}
+        report['endpoints'] = run_sessions(make_transport, user_ids, args.sessions, args.threads,
+                                           args.create_ratio, classes, enemies, args.seed)
+        print_table("endpoints", report['endpoints'])
+        if args.micro and user_ids:
+            report['micro'] = run_micro(bot, user_ids, args.micro, args.seed)
+            print_table("micro-benchmarks", report['micro'])
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"\nbaseline written to {args.save_baseline}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"\nno regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == '__main__':
+    main()
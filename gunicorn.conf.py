@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Gunicorn settings, picked up automatically by `gunicorn webapp_bot:app`.
+
+The app is imported once in the master (schema check, catalog encoding,
+route table) and workers are forked from it, so a restart pays the start-up
+cost once instead of once per worker. Connections, background threads and
+the log listener are re-created in each worker after the fork, and each
+worker logs to its own logs/runequestrpg.<pid>.log.
+
+Every worker keeps its own player cache over the same database, so this file
+turns the cache bus on (CACHE_BUS=db) unless the environment already sets
+CACHE_BUS. With the bus on, PLAYER_FLUSH_INTERVAL defaults to 0: each write
+reaches the database before the response and the other workers drop their
+copy of that player within CACHE_BUS_INTERVAL. Without it, two workers
+holding the same player overwrite each other's quest, level and battle
+columns on flush. Set CACHE_BUS=off only for a single worker (-w 1).
+"""
+
+import os
+
+os.environ.setdefault("CACHE_BUS", "db")
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+
+def post_fork(server, worker):
+    # The master never serves requests, so it must not sweep auctions (and
+    # build a player cache of its own doing so); each worker starts its own
+    import webapp_bot
+
+    webapp_bot.auction_house.start()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+RuneQuestRPG batch combat simulator
+
+Runs class x enemy x gear-loadout fights as NumPy array operations using the
+same rules as the server battle sessions (CombatSystem.calculate_damage for
+the player, BattleSession.enemy_turn for the enemy). Needs numpy, which the
+server itself does not:
+
+    python simulator.py --fights 2000 --loadouts all --seed 42
+    python simulator.py --classes mage rogue --enemies dragon --level 5 --csv out.csv
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+
+os.environ.setdefault("BOT_TOKEN", "simulator")
+os.environ.setdefault("DATABASE_PATH", ":memory:")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from webapp_bot import (  # noqa: E402
+    CLASSES, ENEMIES, ITEM_INDEX, CombatSystem, progression,
+)
+
+MAX_ROUNDS = 200
+
+
+def player_stats(class_type: str, level: int) -> dict:
+    cls = CLASSES[class_type]
+    stats = dict(progression.stats(class_type, level))
+    stats.update(crit_chance=cls['crit_chance'], crit_damage=cls['crit_damage'])
+    return stats
+
+
+def build_loadouts(mode: str) -> list:
+    """Equipment dicts to simulate: bare, or every weapon/armor/accessory combination."""
+    if mode == 'none':
+        return [{}]
+    by_slot = {}
+    for item_id, item in ITEM_INDEX.items():
+        if item['slot']:
+            by_slot.setdefault(item['slot'], [None]).append(item_id)
+    slots = sorted(by_slot)
+    loadouts = []
+    for combo in itertools.product(*(by_slot[slot] for slot in slots)):
+        loadouts.append({slot: item_id for slot, item_id in zip(slots, combo) if item_id})
+    return loadouts
+
+
+def loadout_name(equipment: dict) -> str:
+    return '+'.join(equipment[slot] for slot in sorted(equipment)) or 'none'
+
+
+def simulate(rng: np.random.Generator, cells: list, fights: int, skill_rate: float) -> list:
+    """Simulate `fights` battles for every cell at once; returns per-cell results."""
+    n_cells = len(cells)
+    n = n_cells * fights
+
+    def column(key):
+        return np.repeat(np.array([cell[key] for cell in cells], dtype=np.float64), fights)
+
+    attack = column('attack')
+    crit_chance = column('crit_chance') / 100
+    crit_damage = column('crit_damage')
+    mitigation = column('enemy_defense') * 0.4
+    enemy_hp = column('enemy_hp')
+    enemy_hit = np.maximum(1, np.trunc(column('enemy_damage') - column('defense') / 2))
+    player_hp = column('max_health')
+
+    rounds = np.zeros(n, dtype=np.int32)
+    active = np.ones(n, dtype=bool)
+    for _ in range(MAX_ROUNDS):
+        idx = np.flatnonzero(active)
+        if idx.size == 0:
+            break
+        damage = attack[idx] + rng.uniform(-3, 5, idx.size)
+        damage = np.where(rng.random(idx.size) < skill_rate, damage * 1.5, damage)
+        damage = np.where(rng.random(idx.size) < crit_chance[idx], damage * crit_damage[idx], damage)
+        damage = np.maximum(1, np.trunc(damage - mitigation[idx]))
+        enemy_hp[idx] -= damage
+        rounds[idx] += 1
+
+        alive = enemy_hp[idx] > 0
+        player_hp[idx[alive]] -= enemy_hit[idx[alive]]
+        active[idx] = alive & (player_hp[idx] > 0)
+
+    won = (enemy_hp <= 0).reshape(n_cells, fights)
+    rounds = rounds.reshape(n_cells, fights)
+
+    results = []
+    for i, cell in enumerate(cells):
+        win_rounds = rounds[i][won[i]]
+        results.append({
+            'win_rate': float(won[i].mean()),
+            'mean_rounds': float(rounds[i].mean()),
+            'ttk_p50': float(np.percentile(win_rounds, 50)) if win_rounds.size else float('nan'),
+            'ttk_p95': float(np.percentile(win_rounds, 95)) if win_rounds.size else float('nan'),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch-simulate RuneQuestRPG fights for balance testing")
+    parser.add_argument("--classes", nargs="+", default=list(CLASSES), choices=list(CLASSES))
+    parser.add_argument("--enemies", nargs="+", default=list(ENEMIES), choices=list(ENEMIES))
+    parser.add_argument("--loadouts", choices=["none", "all"], default="none")
+    parser.add_argument("--level", type=int, default=1)
+    parser.add_argument("--fights", type=int, default=10000, help="fights per class/enemy/loadout cell")
+    parser.add_argument("--skill-rate", type=float, default=0.0, help="share of attacks that use the skill")
+    parser.add_argument("--turn-seconds", type=float, default=1.5, help="wall-clock seconds per round")
+    parser.add_argument("--chunk", type=int, default=2_000_000, help="max fights simulated per array batch")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--csv", help="write results to this CSV file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    cells = []
+    for class_type, enemy_id, equipment in itertools.product(args.classes, args.enemies, build_loadouts(args.loadouts)):
+        stats = dict(player_stats(class_type, args.level))
+        bonuses = CombatSystem.equipment_bonuses(tuple(sorted(equipment.items())))
+        stats['attack'] += bonuses['attack']
+        stats['defense'] += bonuses['defense']
+        stats['crit_chance'] += bonuses['crit']
+        enemy = ENEMIES[enemy_id]
+        cells.append({
+            **stats, 'class': class_type, 'enemy': enemy_id, 'loadout': loadout_name(equipment),
+            'enemy_hp': enemy['hp'], 'enemy_damage': enemy['damage'], 'enemy_defense': enemy['defense'],
+            'gold': enemy['gold'], 'exp': enemy['exp'],
+        })
+
+    start = time.perf_counter()
+    per_batch = max(1, args.chunk // args.fights)
+    results = []
+    for offset in range(0, len(cells), per_batch):
+        results.extend(simulate(rng, cells[offset:offset + per_batch], args.fights, args.skill_rate))
+    elapsed = time.perf_counter() - start
+
+    rows = []
+    for cell, result in zip(cells, results):
+        minutes = result['mean_rounds'] * args.turn_seconds / 60
+        rows.append({
+            'class': cell['class'], 'enemy': cell['enemy'], 'loadout': cell['loadout'],
+            'win_rate': round(result['win_rate'], 4),
+            'ttk_p50': result['ttk_p50'], 'ttk_p95': result['ttk_p95'],
+            'gold_per_min': round(result['win_rate'] * cell['gold'] / minutes, 1),
+            'exp_per_min': round(result['win_rate'] * cell['exp'] / minutes, 1),
+        })
+
+    if args.csv:
+        with open(args.csv, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        print(f"{'class':<8} {'enemy':<9} {'loadout':<40} {'win%':>6} {'ttk50':>6} {'ttk95':>6} {'gold/m':>8} {'exp/m':>8}")
+        for row in rows:
+            print(f"{row['class']:<8} {row['enemy']:<9} {row['loadout']:<40} {row['win_rate'] * 100:6.1f} "
+                  f"{row['ttk_p50']:6.1f} {row['ttk_p95']:6.1f} {row['gold_per_min']:8.1f} {row['exp_per_min']:8.1f}")
+
+    total = len(cells) * args.fights
+    print(f"{total:,} fights in {elapsed:.2f}s ({total / elapsed:,.0f} fights/s)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+RuneQuestRPG cold-start profile
+
+Imports webapp_bot in fresh interpreters under `python -X importtime`, once
+against an empty database and once against the schema it just created, and
+reports import wall time, the slowest imported modules and the time spent
+in webapp_bot's own module body:
+
+    python startup_profile.py
+    python startup_profile.py --top 30 --max-ms 800 --forbid telegram httpx
+
+--max-ms fails the run when the warm import exceeds the budget, and
+--forbid fails it when any listed module gets imported at startup, so
+regressions in lazy loading are caught.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PROBE = (
+    "import sys, time\n"
+    f"sys.path.insert(0, {ROOT!r})\n"
+    "start = time.perf_counter()\n"
+    "import webapp_bot\n"
+    "print(f'wall_ms={(time.perf_counter() - start) * 1000:.1f}')\n"
+    "print('modules=' + ','.join(sorted(sys.modules)))\n"
+)
+
+
+def profile_import(workdir: str) -> dict:
+    env = dict(os.environ, BOT_TOKEN=os.environ.get("BOT_TOKEN", "startup-profile"),
+               DATABASE_PATH=os.path.join(workdir, "runequestrpg.db"))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=workdir, env=env,
+                          capture_output=True, text=True, check=True)
+    imports = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append((name.strip(), int(self_us), int(cumulative_us), len(name) - len(name.lstrip())))
+    values = dict(line.split("=", 1) for line in proc.stdout.splitlines() if "=" in line)
+    return {
+        'wall_ms': float(values['wall_ms']),
+        'modules': set(values['modules'].split(',')),
+        'imports': imports,
+    }
+
+
+def report(title: str, result: dict, top: int):
+    imports = result['imports']
+    position = next((i for i, entry in enumerate(imports) if entry[0] == 'webapp_bot'), None)
+    body, direct = 0, []
+    if position is not None:
+        _, body, _, depth = imports[position]
+        for entry in reversed(imports[:position]):
+            if entry[3] <= depth:
+                break
+            if entry[3] == depth + 2:
+                direct.append(entry)
+    print(f"\n{title}: import webapp_bot {result['wall_ms']:.1f} ms "
+          f"(module body {body / 1000:.1f} ms, {len(result['modules'])} modules loaded)")
+    print("  slowest direct imports of webapp_bot:")
+    for name, _, cumulative_us, _ in sorted(direct, key=lambda entry: -entry[2])[:top]:
+        print(f"    {cumulative_us / 1000:8.1f} ms  {name}")
+    print("  slowest modules by self time:")
+    for name, self_us, _, _ in sorted(imports, key=lambda entry: -entry[1])[:top]:
+        print(f"    {self_us / 1000:8.1f} ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile RuneQuestRPG import-time startup cost")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--max-ms", type=float, help="fail when the warm import takes longer")
+    parser.add_argument("--forbid", nargs="*", default=["telegram"], help="modules that must not load at startup")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cold = profile_import(workdir)
+        warm = profile_import(workdir)
+    report("empty database", cold, args.top)
+    report("existing database", warm, args.top)
+
+    failures = []
+    if args.max_ms is not None and warm['wall_ms'] > args.max_ms:
+        failures.append(f"warm import took {warm['wall_ms']:.1f} ms, budget is {args.max_ms:.1f} ms")
+    for module in args.forbid or ():
+        if module in warm['modules']:
+            failures.append(f"{module} is imported at startup")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
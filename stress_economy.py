@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+RuneQuestRPG economy concurrency stress test
+
+Hammers /api/buy-item, the auction endpoints and full battles (whose
+battle-end saves the whole player) from many threads at once against a
+throwaway database, then checks that no gold was created or lost, no
+balance went negative and every listing was sold at most once:
+
+    python stress_economy.py --threads 16 --players 20 --rounds 200
+"""
+
+import argparse
+import random
+import sys
+import tempfile
+import threading
+from collections import Counter
+
+from benchmark import load_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrency stress test for gold and item transactions")
+    parser.add_argument("--players", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=200, help="operations per thread")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = load_app(workdir)
+        client = bot.app.test_client()
+        user_ids = list(range(1, args.players + 1))
+        for user_id in user_ids:
+            client.post('/api/create', json={'user_id': user_id, 'class': 'warrior', 'username': f'stress_{user_id}'})
+        start_gold = sum(bot.Database.get_player(user_id)['gold'] for user_id in user_ids)
+
+        spent = Counter()
+        earned = Counter()
+        bought = Counter()
+        sold_listings = Counter()
+        lock = threading.Lock()
+        item = bot.ITEM_INDEX['health_potion']
+
+        def worker(seed: int):
+            rng = random.Random(seed)
+            local = bot.app.test_client()
+            for _ in range(args.rounds):
+                user_id = rng.choice(user_ids)
+                action = rng.random()
+                if action < 0.2:
+                    if local.post('/api/battle-start', json={'user_id': user_id}).status_code != 200:
+                        continue
+                    for _ in range(200):
+                        res = local.post('/api/attack', json={'user_id': user_id})
+                        if res.status_code != 200 or res.json.get('finished'):
+                            break
+                    res = local.post('/api/battle-end', json={'user_id': user_id})
+                    if res.status_code == 200:
+                        with lock:
+                            earned['battles'] += res.json['gold'] + sum(
+                                bot.DAILY_QUESTS[quest_id]['reward'] for quest_id in res.json['unlocked']
+                                if quest_id in bot.DAILY_QUESTS)
+                elif action < 0.5:
+                    res = local.post('/api/buy-item', json={'user_id': user_id, 'item_id': item['id']})
+                    if res.status_code == 200:
+                        with lock:
+                            spent['shop'] += item['price']
+                            bought[user_id] += 1
+                elif action < 0.75:
+                    local.post('/api/auction/list', json={'user_id': user_id, 'item_id': item['id'], 'price': rng.randint(1, 50)})
+                else:
+                    listings = local.get('/api/auction?limit=5').json
+                    if not listings:
+                        continue
+                    listing = rng.choice(listings)
+                    res = local.post('/api/auction/buy', json={'user_id': user_id, 'listing_id': listing['listing_id']})
+                    if res.status_code == 200:
+                        with lock:
+                            sold_listings[listing['listing_id']] += 1
+
+        threads = [threading.Thread(target=worker, args=(args.seed + i,)) for i in range(args.threads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        bot.player_cache.flush()
+        with bot.Database.connection() as conn:
+            db_gold = conn.execute('SELECT SUM(gold) FROM players').fetchone()[0]
+            negative = conn.execute('SELECT COUNT(*) FROM players WHERE gold < 0').fetchone()[0]
+            items_held = conn.execute('SELECT COALESCE(SUM(quantity), 0) FROM player_items').fetchone()[0]
+            items_listed = conn.execute('SELECT COUNT(*) FROM auction_items').fetchone()[0]
+        cached_gold = sum(bot.Database.get_player(user_id)['gold'] for user_id in user_ids)
+
+        failures = []
+        if db_gold != start_gold - spent['shop'] + earned['battles']:
+            failures.append(f"database gold {db_gold} != {start_gold} - {spent['shop']} spent in shop "
+                            f"+ {earned['battles']} won in battles and quests")
+        if cached_gold != db_gold:
+            failures.append(f"cached gold {cached_gold} != database gold {db_gold}")
+        if negative:
+            failures.append(f"{negative} players with negative gold")
+        if items_held + items_listed != sum(bought.values()):
+            failures.append(f"{items_held} held + {items_listed} listed != {sum(bought.values())} bought")
+        double_sold = [listing_id for listing_id, count in sold_listings.items() if count > 1]
+        if double_sold:
+            failures.append(f"listings sold more than once: {double_sold}")
+
+        print(f"shop purchases={sum(bought.values())} auction sales={sum(sold_listings.values())} "
+              f"open listings={items_listed} battle gold={earned['battles']}")
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        if failures:
+            sys.exit(1)
+        print("OK")
+
+
+if __name__ == '__main__':
+    main()
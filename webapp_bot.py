@@ -11,38 +11,247 @@ import logging
 import json
 import time
 import math
-from typing import Optional, Dict, Any, List, Tuple
-from datetime import datetime, timedelta
+import threading
+import weakref
+import atexit
+import bisect
+import functools
+import heapq
+import gzip
+import hashlib
+import queue
+import shutil
+import contextvars
+import copy
+import io
+import re
+import socket
+import sys
+from collections import OrderedDict, deque
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from itertools import islice
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Optional, Dict, Any, List, Tuple
+from dataclasses import dataclass, field, fields
+from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, jsonify
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
-from telegram.ext import Application, CommandHandler, ContextTypes
+from flask import Flask, Response, g, render_template, request, jsonify
+from flask.json.provider import DefaultJSONProvider
+
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import Application, ContextTypes
 
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 WEBAPP_URL = os.getenv("WEBAPP_URL", "https://quest-bot-webapp.onrender.com/")
 PORT = int(os.getenv("PORT", "5000"))
+DB_PATH = os.getenv("DATABASE_PATH", "runequestrpg.db")
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Several processes sharing one database must hear each other's writes, or a
+# worker's stale cached player overwrites columns another worker just changed.
+# gunicorn.conf.py turns the bus on for its workers; WEB_CONCURRENCY (read by
+# both gunicorn and uvicorn as the worker count) does the same here.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+CACHE_BUS = os.getenv("CACHE_BUS", "db" if DATABASE_URL or WEB_CONCURRENCY > 1 else "off")
+CACHE_BUS_INTERVAL = float(os.getenv("CACHE_BUS_INTERVAL", "0.25"))
+CACHE_BUS_RETENTION = float(os.getenv("CACHE_BUS_RETENTION", "300"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024)))
+PLAYER_CACHE_SIZE = int(os.getenv("PLAYER_CACHE_SIZE", "10000"))
+PLAYER_FLUSH_INTERVAL = float(os.getenv("PLAYER_FLUSH_INTERVAL", "0" if CACHE_BUS != "off" else "2.0"))
+BATTLE_SESSION_TTL = int(os.getenv("BATTLE_SESSION_TTL", "900"))
+BATTLE_LOG_QUEUE_SIZE = int(os.getenv("BATTLE_LOG_QUEUE_SIZE", "10000"))
+BATTLE_LOG_BATCH_SIZE = int(os.getenv("BATTLE_LOG_BATCH_SIZE", "500"))
+BATTLE_LOG_FLUSH_INTERVAL = float(os.getenv("BATTLE_LOG_FLUSH_INTERVAL", "1.0"))
+CATALOG_MAX_AGE = int(os.getenv("CATALOG_MAX_AGE", "3600"))
+AUCTION_LISTING_TTL = int(os.getenv("AUCTION_LISTING_TTL", str(72 * 3600)))
+AUCTION_SWEEP_INTERVAL = float(os.getenv("AUCTION_SWEEP_INTERVAL", "60"))
+MAX_LEVEL = int(os.getenv("MAX_LEVEL", "100"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "250"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+LOG_DIR = os.getenv("LOG_DIR", "logs")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(20 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "10"))
+LOG_ACCESS_SAMPLE_RATE = float(os.getenv("LOG_ACCESS_SAMPLE_RATE", "0.01"))
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto")
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import psycopg
+except ImportError:
+    psycopg = None
 
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN not found in .env")
 
-if not os.path.exists("logs"):
-    os.makedirs("logs", exist_ok=True)
+# ===================== LOGGING =====================
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler("logs/runequestrpg.log", encoding="utf-8"),
-        logging.StreamHandler(),
-    ],
-)
+log_context: contextvars.ContextVar = contextvars.ContextVar('log_context', default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the request context fields."""
+
+    CONTEXT_FIELDS = ('request_id', 'user_id', 'route', 'method', 'status', 'duration_ms', 'sampled')
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in self.CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LogContextFilter(logging.Filter):
+    """Samples records carrying a `sample_rate` and stamps the request context.
+
+    Runs on the calling thread before the record is queued, so dropped
+    samples cost nothing further and the context is captured where it is
+    known.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = getattr(record, 'sample_rate', None)
+        if rate is not None:
+            if random.random() >= rate:
+                return False
+            record.sampled = rate
+        context = log_context.get()
+        if context:
+            for key, value in context.items():
+                if getattr(record, key, None) is None:
+                    setattr(record, key, value)
+        return True
+
+
+class BoundedQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the buffer is full."""
+
+    EXC_FORMATTER = logging.Formatter()
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Merge args into msg and render the traceback into exc_text, keeping them apart.
+
+        The stock prepare formats the whole record into msg, which would put
+        the traceback inside the JSON `msg` field instead of `exc`.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or self.EXC_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
 
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def gzip_rotator(source: str, dest: str):
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def log_file_path(pid: Optional[int] = None) -> str:
+    """The log file of the main process, or of worker `pid`."""
+    return os.path.abspath(os.path.join(LOG_DIR, "runequestrpg.log" if pid is None else f"runequestrpg.{pid}.log"))
+
+
+def setup_logging() -> Tuple[BoundedQueueHandler, QueueListener]:
+    """Route all logging through a bounded queue drained by one listener thread.
+
+    Each process rotates its own file: worker processes (forked by gunicorn,
+    spawned by uvicorn --workers) write to runequestrpg.<pid>.log, since two
+    RotatingFileHandlers on one file lose records whenever either rotates.
+    """
+    os.makedirs(LOG_DIR, exist_ok=True)
+    mp = sys.modules.get('multiprocessing')
+    worker = mp is not None and mp.parent_process() is not None
+    file_handler = RotatingFileHandler(
+        log_file_path(os.getpid() if worker else None), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+        encoding="utf-8", delay=True,
+    )
+    file_handler.namer = lambda name: name + '.gz'
+    file_handler.rotator = gzip_rotator
+    file_handler.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else
+                              logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+
+    handler = BoundedQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(LogContextFilter())
+    listener = QueueListener(handler.queue, file_handler, stream_handler, respect_handler_level=True)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    def restart_in_child():
+        if file_handler.stream is not None:
+            file_handler.stream.close()
+            file_handler.stream = None
+        file_handler.baseFilename = log_file_path(os.getpid())
+        handler.queue = listener.queue = queue.Queue(LOG_QUEUE_SIZE)
+        listener._thread = None
+        listener.start()
+
+    os.register_at_fork(after_in_child=restart_in_child)
+    return handler, listener
+
+
+log_handler, log_listener = setup_logging()
 logger = logging.getLogger("RuneQuestRPG")
 
 # ===================== GAME CONSTANTS =====================
 
+# Largest value an INTEGER column holds; bigger JSON numbers fail to bind
+SQL_INT_MAX = 2 ** 63 - 1
+
 LEVEL_UP_EXP = 150
+SKILL_MANA_COST = 25
 BASE_STAT_MULTIPLIER = 1.1
 
 CLASSES = {
@@ -98,88 +307,1497 @@ DAILY_QUESTS = {
 }
 
 ACHIEVEMENTS = {
-    "first_kill": {"name": "First Blood", "emoji": "🐛", "description": "Defeat your first enemy", "points": 10},
-    "level_5": {"name": "Growing Strong", "emoji": "💪", "description": "Reach level 5", "points": 50},
-    "level_10": {"name": "Legendary", "emoji": "👑", "description": "Reach level 10", "points": 100},
-    "rich": {"name": "Wealthy", "emoji": "💎", "description": "Accumulate 5000 gold", "points": 75},
-    "hundred_kills": {"name": "Slayer", "emoji": "⚔️", "description": "Defeat 100 enemies", "points": 200},
+    "first_kill": {"name": "First Blood", "emoji": "🐛", "description": "Defeat your first enemy", "points": 10, "event": "kill", "stat": "kills", "target": 1},
+    "level_5": {"name": "Growing Strong", "emoji": "💪", "description": "Reach level 5", "points": 50, "event": "level_up", "stat": "level", "target": 5},
+    "level_10": {"name": "Legendary", "emoji": "👑", "description": "Reach level 10", "points": 100, "event": "level_up", "stat": "level", "target": 10},
+    "rich": {"name": "Wealthy", "emoji": "💎", "description": "Accumulate 5000 gold", "points": 75, "event": "gold_gained", "stat": "gold", "target": 5000},
+    "hundred_kills": {"name": "Slayer", "emoji": "⚔️", "description": "Defeat 100 enemies", "points": 200, "event": "kill", "stat": "kills", "target": 100},
 }
 
+# DAILY_QUESTS "type" -> event that advances it
+QUEST_EVENTS = {"kills": "kill", "gold": "gold_gained", "exp": "exp_gained"}
+
+# ===================== METRICS =====================
+
+class Histogram:
+    """Log-linear latency histogram (HDR-style: fixed sub-buckets per power of two).
+
+    Bucket bounds are shared by every series so recording is one bisect
+    and two adds under a lock.
+    """
+
+    def __init__(self, bounds: List[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def log_bounds(low: float, high: float, per_doubling: int = 4) -> List[float]:
+        bounds = []
+        value = low
+        while value <= high:
+            bounds.append(float(f'{value:.6g}'))
+            value *= 2 ** (1 / per_doubling)
+        return bounds
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += value
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self.counts), self.total
+
+
+class Metrics:
+    """Process-wide request, database and JSON timings rendered for Prometheus.
+
+    Series are keyed by label tuples; route labels come from the matched
+    Flask rule, so cardinality stays bounded by the route table.
+    """
+
+    LATENCY_BOUNDS = Histogram.log_bounds(0.00005, 30.0)
+    COUNT_BOUNDS = [0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89]
+
+    def __init__(self, enabled: bool, slow_seconds: float, profile_rate: float):
+        self.enabled = enabled
+        self.slow_seconds = slow_seconds
+        self.profile_rate = profile_rate
+        self.slow_samples: deque = deque(maxlen=50)
+        self._series: Dict[Tuple, Histogram] = {}
+        self._counters: Dict[Tuple, int] = {}
+        self._collected: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._profile_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _histogram(self, key: Tuple, bounds: List[float]) -> Histogram:
+        histogram = self._series.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._series.setdefault(key, Histogram(bounds))
+        return histogram
+
+    def observe(self, name: str, labels: Tuple, value: float, bounds: Optional[List[float]] = None):
+        self._histogram((name, labels), bounds or self.LATENCY_BOUNDS).observe(value)
+
+    def increment(self, name: str, labels: Tuple, amount: int = 1):
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + amount
+
+    def register_counter(self, name: str, read):
+        """Expose a counter maintained elsewhere; `read()` is called at render time."""
+        self._collected[name] = read
+
+    def timed(self, name: str, labels: Tuple):
+        """Decorator recording the wrapped call's duration into `name`."""
+        def decorator(func):
+            if not self.enabled:
+                return func
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, labels, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def instrument(self, cls, name: str, exclude: Tuple[str, ...] = ()):
+        """Wrap every public static method of `cls` with `timed`."""
+        for attr, value in list(vars(cls).items()):
+            if attr.startswith('_') or attr in exclude or not isinstance(value, staticmethod):
+                continue
+            setattr(cls, attr, staticmethod(self.timed(name, (('method', attr),))(value.__func__)))
+
+    # ----- per-request state -----
+
+    def count_query(self):
+        self._local.queries = getattr(self._local, 'queries', 0) + 1
+
+    def begin_request(self):
+        self._local.queries = 0
+        self._local.start = time.perf_counter()
+        self._local.profiler = None
+        if self.profile_rate and random.random() < self.profile_rate and self._profile_lock.acquire(blocking=False):
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                self._local.profiler = profiler
+            except ValueError:
+                self._profile_lock.release()
+
+    def end_request(self, route: str, method: str, status: int):
+        start = getattr(self._local, 'start', None)
+        if start is None:
+            return
+        duration = time.perf_counter() - start
+        queries = self._local.queries
+        profiler = self._local.profiler
+        self._local.start = self._local.profiler = None
+        if profiler is not None:
+            profiler.disable()
+            self._profile_lock.release()
+
+        self.record_request(route, method, status, duration, queries)
+        if duration >= self.slow_seconds:
+            sample = {'route': route, 'method': method, 'status': status,
+                      'duration_ms': round(duration * 1000, 2), 'queries': queries, 'at': time.time()}
+            if profiler is not None:
+                import pstats
+                out = io.StringIO()
+                pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(25)
+                sample['profile'] = out.getvalue()
+            self.slow_samples.append(sample)
+            logger.warning(f"Slow request {method} {route} {status}: {sample['duration_ms']}ms, {queries} queries")
+
+    def record_request(self, route: str, method: str, status: int, duration: float, queries: int = 0):
+        labels = (('route', route), ('method', method))
+        self.observe('runequest_request_duration_seconds', labels, duration)
+        self.observe('runequest_request_queries', labels, queries, self.COUNT_BOUNDS)
+        self.increment('runequest_requests_total', labels + (('status', str(status)),))
+        if duration >= self.slow_seconds:
+            self.increment('runequest_slow_requests_total', labels)
+
+    # ----- exposition -----
+
+    @staticmethod
+    def _labels(labels: Tuple) -> str:
+        return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}' if labels else ''
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            series = sorted(self._series.items())
+            counters = sorted(self._counters.items())
+        lines = []
+        seen = set()
+        for (name, labels), histogram in series:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f'# TYPE {name} histogram')
+            counts, total = histogram.snapshot()
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{self._labels(labels + (("le", bound),))} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{name}_bucket{self._labels(labels + (("le", "+Inf"),))} {cumulative}')
+            lines.append(f'{name}_sum{self._labels(labels)} {total}')
+            lines.append(f'{name}_count{self._labels(labels)} {cumulative}')
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{self._labels(labels)} {value}')
+        for name, read in sorted(self._collected.items()):
+            lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name} {read()}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics(METRICS_ENABLED, SLOW_REQUEST_MS / 1000, PROFILE_SAMPLE_RATE)
+metrics.register_counter('runequest_log_records_dropped_total', lambda: log_handler.dropped)
+
+
+class CountingConnection(sqlite3.Connection):
+    """sqlite3 connection that counts statements toward the current request."""
+
+    def execute(self, *args, **kwargs):
+        metrics.count_query()
+        return super().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        metrics.count_query()
+        return super().executemany(*args, **kwargs)
+
 # ===================== DATABASE =====================
 
-class Database:
+def open_sqlite(path: str) -> sqlite3.Connection:
+    """Open an autocommit SQLite connection with the server's pragmas."""
+    conn = sqlite3.connect(
+        path,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,
+        check_same_thread=False,
+        factory=CountingConnection if metrics.enabled else sqlite3.Connection,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
+
+
+class SQLiteDialect:
+    """SQL that differs between backends, as SQLite spells it."""
+
+    name = 'sqlite'
+
     @staticmethod
-    def init():
-        conn = sqlite3.connect('runequestrpg.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS players (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT UNIQUE,
-                class_type TEXT NOT NULL,
-                level INTEGER DEFAULT 1,
-                exp INTEGER DEFAULT 0,
-                health INTEGER NOT NULL,
-                max_health INTEGER NOT NULL,
-                mana INTEGER NOT NULL,
-                max_mana INTEGER NOT NULL,
-                attack INTEGER NOT NULL,
-                defense INTEGER NOT NULL,
-                crit_chance REAL NOT NULL,
-                dodge_chance REAL NOT NULL,
-                crit_damage REAL NOT NULL,
-                gold INTEGER NOT NULL,
-                inventory TEXT DEFAULT '{}',
-                equipment TEXT DEFAULT '{}',
-                kills INTEGER DEFAULT 0,
-                battles_won INTEGER DEFAULT 0,
-                battles_lost INTEGER DEFAULT 0,
-                damage_dealt INTEGER DEFAULT 0,
-                total_exp INTEGER DEFAULT 0,
-                skill_cooldowns TEXT DEFAULT '{}',
-                achievements TEXT DEFAULT '{}',
-                daily_quests TEXT DEFAULT '{}',
-                created_at TEXT NOT NULL,
-                updated_at TEXT NOT NULL
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS battles (
-                battle_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                enemy_name TEXT,
-                won BOOLEAN,
-                damage_dealt INTEGER,
-                damage_taken INTEGER,
-                battle_date TEXT,
-                duration INTEGER
+    def begin(conn, immediate: bool):
+        conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+
+    @staticmethod
+    def lock_schema(conn):
+        """Serialize schema changes between processes (BEGIN IMMEDIATE already does)."""
+
+    @staticmethod
+    def in_transaction(conn) -> bool:
+        return conn.in_transaction
+
+    @staticmethod
+    def schema_version(conn) -> int:
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+
+    @staticmethod
+    def set_schema_version(conn, version: int):
+        conn.execute(f'PRAGMA user_version = {int(version)}')
+
+    @staticmethod
+    def table_columns(conn, table: str) -> set:
+        return {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+class ThreadConnection:
+    """One thread's SQLite connection, closed when the thread's local storage is dropped."""
+
+    __slots__ = ('conn', 'pid', '__weakref__')
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.pid = os.getpid()
+
+    def close(self):
+        try:
+            self.conn.close()
+        except sqlite3.Error:
+            pass
+
+    def __del__(self):
+        self.close()
+
+
+class SQLiteBackend(SQLiteDialect):
+    """Default storage: one SQLite file and a reusable connection per thread.
+
+    Each worker thread keeps one open connection for its lifetime instead of
+    connecting on every query; it is closed when the thread exits, so a
+    thread-per-request server does not leak file descriptors. Connections
+    are tied to the process that opened them, so a gunicorn worker forked
+    from a preloaded master never reuses the master's handle.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: weakref.WeakSet = weakref.WeakSet()
+
+    def acquire(self) -> sqlite3.Connection:
+        holder = getattr(self._local, 'holder', None)
+        if holder is None or holder.pid != os.getpid():
+            holder = self._local.holder = ThreadConnection(open_sqlite(self.path))
+            with self._lock:
+                self._connections.add(holder)
+        return holder.conn
+
+    def release(self, conn):
+        pass
+
+    def close_all(self):
+        with self._lock:
+            for holder in list(self._connections):
+                holder.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+class PooledBackend:
+    """Bounded connection pool for a database shared by several processes or hosts.
+
+    A thread checks a connection out on its outermost `Database.connection()`
+    or `transaction()` and keeps it pinned for nested calls, returning it to
+    the pool when the outermost block exits. At most `size` connections are
+    open per process; callers wait up to `timeout` seconds for one.
+    """
+
+    def __init__(self, size: int, timeout: float):
+        self.size = size
+        self.timeout = timeout
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._local = threading.local()
+
+    def connect(self):
+        raise NotImplementedError
+
+    def acquire(self):
+        if self._pid != os.getpid():
+            self._reset()
+        local = self._local
+        if getattr(local, 'depth', 0):
+            local.depth += 1
+            return local.conn
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"No database connection free within {self.timeout}s")
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                conn = self.connect()
+            except BaseException:
+                self._slots.release()
+                raise
+        local.conn, local.depth = conn, 1
+        return conn
+
+    def release(self, conn):
+        local = self._local
+        local.depth -= 1
+        if local.depth:
+            return
+        local.conn = None
+        if self.in_transaction(conn):
+            conn.rollback()
+        self._idle.put(conn)
+        self._slots.release()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class SQLitePoolBackend(SQLiteDialect, PooledBackend):
+    """PooledBackend over a SQLite file (DATABASE_URL=sqlite+pool:///path).
+
+    Stand-in for a database server when running several workers or
+    processes locally: it exercises the pool and the cache bus exactly as
+    PostgreSQL would, without needing one.
+    """
+
+    def __init__(self, path: str, size: int, timeout: float):
+        self.path = path
+        PooledBackend.__init__(self, size, timeout)
+
+    def connect(self) -> sqlite3.Connection:
+        return open_sqlite(self.path)
+
+
+class SQLRow(tuple):
+    """Result row addressable by index, slice or column name, like sqlite3.Row."""
+
+    def __new__(cls, values, index: Dict[str, int]):
+        row = super().__new__(cls, values)
+        row._index = index
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self._index[key])
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return list(self._index)
+
+
+def sql_row_factory(cursor):
+    index = {column.name: i for i, column in enumerate(cursor.description or ())}
+    return lambda values: SQLRow(values, index)
+
+
+class PostgresConnection:
+    """sqlite3-style facade over a psycopg connection.
+
+    Translates `?` placeholders and SQLite DDL (INTEGER, REAL, BOOLEAN,
+    AUTOINCREMENT, WITHOUT ROWID) and passes booleans as integers, so the
+    statements elsewhere in this module run unchanged. BOOLEAN columns
+    become INTEGER because SQLite stores them as 0/1 and readers already
+    convert with bool().
+    """
+
+    DDL_REWRITES = (
+        (re.compile(r'INTEGER PRIMARY KEY AUTOINCREMENT', re.I), 'BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY'),
+        (re.compile(r'\bINTEGER\b', re.I), 'BIGINT'),
+        (re.compile(r'\bREAL\b', re.I), 'DOUBLE PRECISION'),
+        (re.compile(r'\bBOOLEAN\b', re.I), 'INTEGER'),
+        (re.compile(r'\)\s*WITHOUT ROWID', re.I), ')'),
+    )
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def translate(sql: str) -> str:
+        if sql.lstrip()[:6].upper() in ('CREATE', 'ALTER '):
+            for pattern, replacement in PostgresConnection.DDL_REWRITES:
+                sql = pattern.sub(replacement, sql)
+        return sql.replace('%', '%%').replace('?', '%s')
+
+    @staticmethod
+    def adapt(params) -> tuple:
+        return tuple(int(value) if value.__class__ is bool else value for value in params)
+
+    @property
+    def in_transaction(self) -> bool:
+        return self.raw.info.transaction_status != psycopg.pq.TransactionStatus.IDLE
+
+    def execute(self, sql: str, params=()):
+        metrics.count_query()
+        return self.raw.execute(self.translate(sql), self.adapt(params))
+
+    def executemany(self, sql: str, seq):
+        metrics.count_query()
+        cursor = self.raw.cursor()
+        cursor.executemany(self.translate(sql), [self.adapt(params) for params in seq])
+        return cursor
+
+    def cursor(self):
+        return self
+
+    def commit(self):
+        self.raw.execute('COMMIT')
+
+    def rollback(self):
+        self.raw.execute('ROLLBACK')
+
+    def close(self):
+        self.raw.close()
+
+
+class PostgresBackend(PooledBackend):
+    """PostgreSQL through psycopg (DATABASE_URL=postgresql://...)."""
+
+    name = 'postgresql'
+
+    def __init__(self, url: str, size: int, timeout: float):
+        if psycopg is None:
+            raise RuntimeError("DATABASE_URL points at PostgreSQL but psycopg is not installed")
+        self.url = url
+        super().__init__(size, timeout)
+
+    def connect(self) -> PostgresConnection:
+        return PostgresConnection(psycopg.connect(self.url, autocommit=True, row_factory=sql_row_factory))
+
+    @staticmethod
+    def begin(conn, immediate: bool):
+        conn.execute('BEGIN')
+
+    @staticmethod
+    def lock_schema(conn):
+        conn.execute('SELECT pg_advisory_xact_lock(74201)')
+
+    @staticmethod
+    def in_transaction(conn) -> bool:
+        return conn.in_transaction
+
+    @staticmethod
+    def schema_version(conn) -> int:
+        conn.execute('CREATE TABLE IF NOT EXISTS schema_meta (version INTEGER NOT NULL)')
+        row = conn.execute('SELECT MAX(version) FROM schema_meta').fetchone()
+        return row[0] or 0
+
+    @staticmethod
+    def set_schema_version(conn, version: int):
+        conn.execute('DELETE FROM schema_meta')
+        conn.execute('INSERT INTO schema_meta (version) VALUES (?)', (version,))
+
+    @staticmethod
+    def table_columns(conn, table: str) -> set:
+        cursor = conn.execute(
+            'SELECT column_name FROM information_schema.columns WHERE table_name = ? AND table_schema = current_schema()',
+            (table,)
+        )
+        return {row[0] for row in cursor}
+
+
+def create_backend(url: str, path: str):
+    """Storage backend for DATABASE_URL; empty means the local SQLite file at `path`."""
+    if not url:
+        return SQLiteBackend(path)
+    if url.startswith('sqlite+pool://'):
+        return SQLitePoolBackend(url[len('sqlite+pool://'):], DB_POOL_SIZE, DB_POOL_TIMEOUT)
+    if url.startswith(('postgres://', 'postgresql://')):
+        return PostgresBackend(url, DB_POOL_SIZE, DB_POOL_TIMEOUT)
+    raise ValueError(f"Unsupported DATABASE_URL scheme: {url.split(':', 1)[0]}")
+
+
+class ChildTable:
+    """A dict-valued player field stored as one row per key.
+
+    `columns` are (name, sql type, loader) triples. With a single column the
+    dict value is that column's value; with several it is a {column: value}
+    dict, as for daily quests. An `additive` table holds a single counter
+    column that is written as increments, so cache flushes commute with
+    direct SQL updates (see Economy).
+    """
+
+    def __init__(self, field: str, table: str, key: str, columns: Tuple[Tuple[str, str, Any], ...],
+                 additive: bool = False):
+        self.field = field
+        self.table = table
+        self.key = key
+        self.columns = columns
+        self.names = tuple(name for name, _, _ in columns)
+        self.additive = additive
+
+    def schema(self) -> List[str]:
+        column_defs = ', '.join(f'{name} {sql_type}' for name, sql_type, _ in self.columns)
+        return [
+            f'''CREATE TABLE IF NOT EXISTS {self.table} (
+                user_id INTEGER NOT NULL,
+                {self.key} TEXT NOT NULL,
+                {column_defs},
+                PRIMARY KEY (user_id, {self.key})
+            ) WITHOUT ROWID''',
+            f'CREATE INDEX IF NOT EXISTS idx_{self.table}_{self.key} ON {self.table} ({self.key}, user_id)',
+        ]
+
+    def to_rows(self, mapping: Dict) -> Dict[str, Tuple]:
+        if len(self.columns) == 1:
+            return {str(key): (value,) for key, value in mapping.items()}
+        return {str(key): tuple(value.get(name) for name in self.names) for key, value in mapping.items()}
+
+    def to_mapping(self, rows) -> Dict:
+        mapping = {}
+        for row in rows:
+            values = [loader(row[name]) if row[name] is not None else None for name, _, loader in self.columns]
+            mapping[row[self.key]] = values[0] if len(values) == 1 else dict(zip(self.names, values))
+        return mapping
+
+    def load(self, conn: sqlite3.Connection, user_id: int) -> Dict:
+        cursor = conn.execute(
+            f'SELECT {self.key}, {", ".join(self.names)} FROM {self.table} WHERE user_id = ?', (user_id,)
+        )
+        return self.to_mapping(cursor.fetchall())
+
+    def write(self, conn: sqlite3.Connection, user_id: int, upserts: Dict[str, Tuple], deletes=()):
+        if upserts:
+            placeholders = ', '.join('?' * (len(self.names) + 2))
+            updates = ', '.join(f'{name} = excluded.{name}' for name in self.names)
+            conn.executemany(
+                f'''INSERT INTO {self.table} (user_id, {self.key}, {", ".join(self.names)}) VALUES ({placeholders})
+                    ON CONFLICT (user_id, {self.key}) DO UPDATE SET {updates}''',
+                [(user_id, key, *values) for key, values in upserts.items()]
             )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS auction_items (
-                item_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                seller_id INTEGER,
-                item_name TEXT,
-                item_data TEXT,
-                price INTEGER,
-                created_at TEXT
+        if deletes:
+            conn.executemany(
+                f'DELETE FROM {self.table} WHERE user_id = ? AND {self.key} = ?',
+                [(user_id, key) for key in deletes]
             )
-        ''')
+
+    def write_deltas(self, conn: sqlite3.Connection, user_id: int, deltas: Dict[str, int]):
+        """Add `deltas` to an additive table's counters, dropping rows that reach zero."""
+        name = self.names[0]
+        conn.executemany(
+            f'''INSERT INTO {self.table} (user_id, {self.key}, {name}) VALUES (?, ?, ?)
+                ON CONFLICT (user_id, {self.key}) DO UPDATE SET {name} = {name} + excluded.{name}''',
+            [(user_id, key, delta) for key, delta in deltas.items()]
+        )
+        conn.execute(f'DELETE FROM {self.table} WHERE user_id = ? AND {name} <= 0', (user_id,))
+
+
+CHILD_TABLES = (
+    ChildTable('inventory', 'player_items', 'item_id', (('quantity', 'INTEGER NOT NULL', int),), additive=True),
+    ChildTable('equipment', 'player_equipment', 'slot', (('item_id', 'TEXT NOT NULL', str),)),
+    ChildTable('skill_cooldowns', 'player_cooldowns', 'skill_id', (('ready_at', 'REAL', float),)),
+    ChildTable('achievements', 'player_achievements', 'achievement_id', (('unlocked', 'INTEGER NOT NULL', bool),)),
+    ChildTable('daily_quests', 'player_quests', 'quest_id',
+               (('progress', 'INTEGER NOT NULL DEFAULT 0', int), ('completed', 'INTEGER NOT NULL DEFAULT 0', bool))),
+)
+
+
+@dataclass(slots=True)
+class Player:
+    """A player row plus its child-table fields.
+
+    Slotted, so a cached player costs a fraction of the equivalent dict.
+    Item access (`player['gold']`, `get`, `update`, `keys`) is kept so code
+    written against row dicts works unchanged; unknown keys are errors.
+    `_base` is not a column and is never serialized: copies handed out by
+    PlayerCache.get record the gold and inventory they started from, so a
+    save applies only the caller's own change to those fields (see
+    PlayerCache.update).
+    """
+
+    user_id: int
+    username: Optional[str]
+    class_type: str
+    level: int = 1
+    exp: int = 0
+    health: int = 0
+    max_health: int = 0
+    mana: int = 0
+    max_mana: int = 0
+    attack: int = 0
+    defense: int = 0
+    crit_chance: float = 0.0
+    dodge_chance: float = 0.0
+    crit_damage: float = 0.0
+    gold: int = 0
+    kills: int = 0
+    battles_won: int = 0
+    battles_lost: int = 0
+    damage_dealt: int = 0
+    total_exp: int = 0
+    quests_date: str = ''
+    created_at: str = ''
+    updated_at: str = ''
+    inventory: Dict[str, int] = field(default_factory=dict)
+    equipment: Dict[str, str] = field(default_factory=dict)
+    skill_cooldowns: Dict[str, float] = field(default_factory=dict)
+    achievements: Dict[str, bool] = field(default_factory=dict)
+    daily_quests: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    _base: Optional[Tuple[int, Dict[str, int]]] = field(default=None, init=False, repr=False, compare=False)
+
+    @classmethod
+    def from_row(cls, row, children: Dict[str, Dict]) -> 'Player':
+        """Build from a row selected with `PLAYER_COLUMNS` and the loaded child tables."""
+        return cls(*row[:len(PLAYER_COLUMNS)], **children)
+
+    @staticmethod
+    def copy_value(name: str, value: Any) -> Any:
+        if name == 'daily_quests':
+            return {quest_id: dict(quest) for quest_id, quest in (value or {}).items()}
+        if name in PLAYER_CHILD_FIELDS:
+            return dict(value or {})
+        return value
+
+    def copy(self) -> 'Player':
+        return Player(*(self.copy_value(name, getattr(self, name)) for name in PLAYER_FIELDS))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in PLAYER_FIELDS}
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value: Any):
+        if key not in PLAYER_FIELD_SET:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in PLAYER_FIELD_SET
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default) if key in PLAYER_FIELD_SET else default
+
+    def keys(self):
+        return PLAYER_FIELDS
+
+    def items(self):
+        return ((name, getattr(self, name)) for name in PLAYER_FIELDS)
+
+    def update(self, values: Dict[str, Any]):
+        for key, value in values.items():
+            self[key] = value
+
+
+PLAYER_FIELDS = tuple(f.name for f in fields(Player) if f.init)
+PLAYER_FIELD_SET = frozenset(PLAYER_FIELDS)
+PLAYER_CHILD_FIELDS = frozenset(table.field for table in CHILD_TABLES)
+PLAYER_COLUMNS = tuple(name for name in PLAYER_FIELDS if name not in PLAYER_CHILD_FIELDS)
+
+
+def migrate_child_tables(conn: sqlite3.Connection):
+    for table in CHILD_TABLES:
+        for statement in table.schema():
+            conn.execute(statement)
+    if 'normalized' not in Database.backend.table_columns(conn, 'players'):
+        conn.execute('ALTER TABLE players ADD COLUMN normalized INTEGER NOT NULL DEFAULT 0')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_players_unnormalized ON players (user_id) WHERE normalized = 0')
+
+
+def migrate_auction_indexes(conn: sqlite3.Connection):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_auction_item_price ON auction_items (item_name, price, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_auction_price ON auction_items (price, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_auction_created ON auction_items (created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_auction_seller ON auction_items (seller_id)')
+
+
+def migrate_cache_events(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS cache_events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            origin TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_events_created ON cache_events (created_at)')
+
+
+def migrate_quest_date(conn: sqlite3.Connection):
+    if 'quests_date' not in Database.backend.table_columns(conn, 'players'):
+        conn.execute("ALTER TABLE players ADD COLUMN quests_date TEXT NOT NULL DEFAULT ''")
+
+
+class Migrations:
+    """Ordered schema changes, tracked in the backend's schema version.
+
+    Each step runs once; Database.init applies any step newer than the
+    stored version.
+    """
+
+    STEPS = (
+        (1, migrate_child_tables),
+        (2, migrate_auction_indexes),
+        (3, migrate_quest_date),
+        (4, migrate_cache_events),
+    )
+
+    @staticmethod
+    def apply(conn: sqlite3.Connection):
+        for version, step in Migrations.STEPS:
+            with Database.transaction(immediate=True):
+                Database.backend.lock_schema(conn)
+                if Database.backend.schema_version(conn) >= version:
+                    continue
+                step(conn)
+                Database.backend.set_schema_version(conn, version)
+                logger.info(f"Applied schema migration {version}")
+
+
+class OnlineMigrator:
+    """Moves legacy JSON columns into the child tables while serving traffic.
+
+    Players are converted lazily on first load; a background sweep converts
+    the rest in small batches, each in its own short write transaction.
+    """
+
+    def __init__(self, batch_size: int = 200):
+        self.batch_size = batch_size
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def normalize_player(conn: sqlite3.Connection, user_id: int) -> bool:
+        """Copy one player's JSON blobs into child rows; False if already done."""
+        row = conn.execute(
+            f'SELECT normalized, {", ".join(t.field for t in CHILD_TABLES)} FROM players WHERE user_id = ?',
+            (user_id,)
+        ).fetchone()
+        if row is None or row['normalized']:
+            return False
+        for table in CHILD_TABLES:
+            table.write(conn, user_id, table.to_rows(json.loads(row[table.field] or '{}')))
+        conn.execute(
+            f'''UPDATE players SET normalized = 1, {", ".join(f"{t.field} = '{{}}'" for t in CHILD_TABLES)}
+                WHERE user_id = ?''',
+            (user_id,)
+        )
+        return True
+
+    def migrate_batch(self) -> int:
+        with Database.transaction(immediate=True) as conn:
+            user_ids = [row['user_id'] for row in conn.execute(
+                'SELECT user_id FROM players WHERE normalized = 0 LIMIT ?', (self.batch_size,)
+            )]
+            for user_id in user_ids:
+                self.normalize_player(conn, user_id)
+        return len(user_ids)
+
+    def run(self):
+        total = 0
+        try:
+            while True:
+                migrated = self.migrate_batch()
+                if not migrated:
+                    break
+                total += migrated
+                time.sleep(0.01)
+        except Exception as e:
+            logger.error(f"Online migration stopped after {total} players: {e}")
+            return
+        if total:
+            logger.info(f"Online migration normalized {total} players")
+
+    def start(self):
+        with Database.connection() as conn:
+            pending = conn.execute('SELECT 1 FROM players WHERE normalized = 0 LIMIT 1').fetchone()
+        if pending and self._thread is None:
+            self._thread = threading.Thread(target=self.run, name='online-migrator', daemon=True)
+            self._thread.start()
+
+
+class PlayerCache:
+    """In-process write-behind cache of player rows.
+
+    Reads are served from memory after the first load. Saves only mark the
+    player dirty; a background flusher writes every dirty player once per
+    `flush_interval` seconds, touching only the columns and child-table rows
+    that differ from what was last persisted. With `flush_interval <= 0` saves are written
+    through immediately. Least recently used players are evicted (flushed
+    first if dirty) once more than `capacity` are held.
+
+    `_lock` guards the in-memory state only; database loads and writes run
+    outside it, and writes are serialized by `_flush_lock` (always taken
+    before `_lock`). The cache is per process: other workers' copies are
+    kept coherent by CacheBus, which drops a player here when another
+    process writes it.
+    """
+
+    JSON_FIELDS = tuple(table.field for table in CHILD_TABLES)
+    SAVE_FIELDS = ('health', 'max_health', 'mana', 'max_mana', 'gold', 'exp', 'level', 'damage_dealt', 'kills',
+                   'battles_won', 'battles_lost', 'total_exp', 'attack', 'defense',
+                   'crit_chance', 'dodge_chance', 'quests_date') + JSON_FIELDS
+    DEFAULTS = {'level': 1, 'quests_date': ''}
+    ADDITIVE_FIELDS = ('gold',)
+    ECONOMY_FIELDS = ('gold', 'inventory')
+    TABLES = {table.field: table for table in CHILD_TABLES}
+
+    @classmethod
+    def default(cls, field: str) -> Any:
+        if field in cls.JSON_FIELDS:
+            return {}
+        return cls.DEFAULTS.get(field, 0)
+
+    def __init__(self, capacity: int, flush_interval: float):
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self._entries: OrderedDict = OrderedDict()
+        self._persisted: Dict[int, Dict[str, Any]] = {}
+        self._dirty: set = set()
+        self._flushing: set = set()
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self._flusher_pid = None
+
+    @classmethod
+    def columns(cls, player: Player) -> Dict[str, Any]:
+        """Persisted form: scalar column values, child fields as keyed rows."""
+        columns = {field: player.get(field, cls.default(field)) for field in cls.SAVE_FIELDS}
+        for table in CHILD_TABLES:
+            columns[table.field] = table.to_rows(player.get(table.field) or {})
+        return columns
+
+    def contains(self, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self._entries
+
+    def get(self, user_id: int) -> Optional[Player]:
+        """Return a private copy of the cached player, or None on a miss."""
+        with self._lock:
+            player = self._entries.get(user_id)
+            if player is None:
+                return None
+            self._entries.move_to_end(user_id)
+            return self._checkout(player)
+
+    def put(self, user_id: int, player: Player) -> Player:
+        """Insert a player freshly loaded from the database.
+
+        Returns a private copy like `get`, taken before eviction runs, so a
+        concurrent eviction cannot turn the load into a miss.
+        """
+        with self._lock:
+            if user_id in self._entries:
+                return self.get(user_id)
+            entry = self._entries[user_id] = player.copy()
+            self._persisted[user_id] = self.columns(player)
+            copy = self._checkout(entry)
+        self._evict()
+        return copy
+
+    @staticmethod
+    def _checkout(entry: Player) -> Player:
+        copy = entry.copy()
+        copy._base = (entry.gold, dict(entry.inventory))
+        return copy
+
+    def update(self, user_id: int, data: Dict):
+        """Stage new column values for a player and mark it dirty.
+
+        Gold and inventory are also changed by Economy through direct SQL
+        while a request holds its copy, so for a copy from `get` only the
+        difference from its `_base` is applied to them; the copy is then
+        rebased onto the merged values. Other sources overwrite them.
+        A player that is not cached is loaded first, outside the lock.
+        """
+        while True:
+            with self._lock:
+                if user_id in self._entries:
+                    self._stage(user_id, data)
+                    break
+            player = player_loads.do(user_id, Database.load_player, user_id)
+            if player is None:
+                return
+            self.put(user_id, player)
+        
+        if self.flush_interval <= 0:
+            self.flush()
+        else:
+            self._ensure_flusher()
+
+    def _stage(self, user_id: int, data: Dict):
+        """Merge `data` into the cached entry and mark it dirty; call with `_lock` held."""
+        entry = self._entries[user_id]
+        base = getattr(data, '_base', None)
+        for field in self.SAVE_FIELDS:
+            if base is not None and field in self.ECONOMY_FIELDS:
+                continue
+            entry[field] = Player.copy_value(field, data.get(field, self.default(field)))
+        if base is not None:
+            base_gold, base_inventory = base
+            entry.gold += data.gold - base_gold
+            inventory = data.inventory
+            for item_id in inventory.keys() | base_inventory.keys():
+                delta = inventory.get(item_id, 0) - base_inventory.get(item_id, 0)
+                if not delta:
+                    continue
+                quantity = entry.inventory.get(item_id, 0) + delta
+                if quantity > 0:
+                    entry.inventory[item_id] = quantity
+                else:
+                    entry.inventory.pop(item_id, None)
+            data.gold, data.inventory = entry.gold, dict(entry.inventory)
+            data._base = (entry.gold, dict(entry.inventory))
+        self._entries.move_to_end(user_id)
+        self._dirty.add(user_id)
+
+    def apply_delta(self, user_id: int, gold: int = 0, items: Optional[Dict[str, int]] = None):
+        """Mirror a change already committed to the database by direct SQL.
+
+        Both the cached value and the persisted snapshot move, so the next
+        flush does not write the change a second time.
+        """
+        with self._lock:
+            player = self._entries.get(user_id)
+            if player is None:
+                return
+            persisted = self._persisted[user_id]
+            player['gold'] += gold
+            persisted['gold'] += gold
+            for item_id, delta in (items or {}).items():
+                quantity = player['inventory'].get(item_id, 0) + delta
+                if quantity > 0:
+                    player['inventory'][item_id] = quantity
+                else:
+                    player['inventory'].pop(item_id, None)
+                stored = persisted['inventory'].get(item_id, (0,))[0] + delta
+                if stored > 0:
+                    persisted['inventory'][item_id] = (stored,)
+                else:
+                    persisted['inventory'].pop(item_id, None)
+
+    def flush_player(self, user_id: int):
+        """Write one player's pending changes now, if there are any."""
+        with self._flush_lock:
+            self._flush_ids([user_id])
+
+    @contextmanager
+    def exclusive(self):
+        """Flush everything and block cache users while the caller rewrites rows.
+
+        All entries are dropped afterwards so they are reloaded from the
+        database.
+        """
+        with self._flush_lock, self._lock:
+            self._flush_ids()
+            try:
+                yield
+            finally:
+                self._entries.clear()
+                self._persisted.clear()
+                self._dirty.clear()
+
+    def invalidate(self, user_id: int):
+        """Drop a player, flushing pending changes first."""
+        with self._flush_lock:
+            if self._flush_and_drop([user_id]):
+                # Saved again during the flush: write the rest with the cache held
+                with self._lock:
+                    self._flush_ids([user_id])
+                    self._entries.pop(user_id, None)
+                    self._persisted.pop(user_id, None)
+
+    def _evict(self):
+        """Flush and drop the least recently used players beyond `capacity`."""
+        if len(self._entries) <= self.capacity:
+            return
+        with self._flush_lock:
+            with self._lock:
+                victims = list(islice(self._entries, max(0, len(self._entries) - self.capacity)))
+            self._flush_and_drop(victims)
+
+    def _flush_and_drop(self, user_ids: List[int]) -> List[int]:
+        """Flush players, then drop those not saved again meanwhile; call with `_flush_lock` held.
+
+        Returns the players that were kept because they are dirty again.
+        """
+        self._flush_ids(user_ids)
+        kept = []
+        with self._lock:
+            for user_id in user_ids:
+                if user_id in self._dirty:
+                    kept.append(user_id)
+                    continue
+                self._entries.pop(user_id, None)
+                self._persisted.pop(user_id, None)
+        return kept
+
+    def flush(self) -> int:
+        """Persist every dirty player in one transaction. Returns rows written.
+
+        The cache lock is held only to collect the changes and to record
+        them as persisted, not during the write, so readers never wait on
+        the database.
+        """
+        with self._flush_lock:
+            return self._flush_ids()
+
+    def _flush_ids(self, user_ids: Optional[List[int]] = None) -> int:
+        """Write the given dirty players (all if None); call with `_flush_lock` held."""
+        with self._lock:
+            pending = self._prepare(list(self._dirty) if user_ids is None else user_ids)
+        if not pending:
+            return 0
+        written = False
+        try:
+            with Database.transaction() as conn:
+                for user_id, changes in pending:
+                    columns = {}
+                    for column, change in changes.items():
+                        table = self.TABLES.get(column)
+                        if table is None:
+                            columns[column] = change
+                        elif table.additive:
+                            table.write_deltas(conn, user_id, change)
+                        else:
+                            table.write(conn, user_id, *change)
+                    Database.write_columns(conn, user_id, columns, self.ADDITIVE_FIELDS)
+                cache_bus.publish(conn, players=[user_id for user_id, _ in pending])
+            written = True
+        finally:
+            with self._lock:
+                self._settle(pending, written)
+        return len(pending)
+
+    def _prepare(self, user_ids: List[int]) -> List[Tuple[int, Dict[str, Any]]]:
+        """Claim dirty players and work out their writes; call with `_lock` held.
+
+        Each change is what gets written: a new value, an increment for
+        additive columns, key deltas for additive child tables and
+        (upserts, deleted keys) for the other child tables.
+        """
+        pending = []
+        for user_id in user_ids:
+            entry = self._entries.get(user_id)
+            if user_id not in self._dirty or entry is None:
+                continue
+            self._dirty.discard(user_id)
+            current, persisted = self.columns(entry), self._persisted.get(user_id, {})
+            changes = {}
+            for column, value in current.items():
+                table = self.TABLES.get(column)
+                old = persisted.get(column, {} if table else None)
+                if old == value:
+                    continue
+                if table is None:
+                    changes[column] = value - (old or 0) if column in self.ADDITIVE_FIELDS else value
+                elif table.additive:
+                    deltas = {key: value.get(key, (0,))[0] - old.get(key, (0,))[0] for key in value.keys() | old.keys()}
+                    changes[column] = {key: delta for key, delta in deltas.items() if delta}
+                else:
+                    changes[column] = ({key: rows for key, rows in value.items() if old.get(key) != rows},
+                                       old.keys() - value.keys())
+            if changes:
+                self._flushing.add(user_id)
+                pending.append((user_id, changes))
+        return pending
+
+    def _settle(self, pending: List[Tuple[int, Dict[str, Any]]], written: bool):
+        """Fold written changes into the persisted snapshots, or mark them dirty again; call with `_lock` held.
+
+        Changes are applied to the snapshot rather than replacing it, so an
+        apply_delta that landed while the write was in flight is kept.
+        """
+        for user_id, changes in pending:
+            self._flushing.discard(user_id)
+            persisted = self._persisted.get(user_id)
+            if persisted is None:
+                continue
+            if not written:
+                self._dirty.add(user_id)
+                continue
+            for column, change in changes.items():
+                table = self.TABLES.get(column)
+                if table is None:
+                    persisted[column] = persisted.get(column, 0) + change if column in self.ADDITIVE_FIELDS else change
+                    continue
+                rows = persisted.setdefault(column, {})
+                if table.additive:
+                    for key, delta in change.items():
+                        stored = rows.get(key, (0,))[0] + delta
+                        if stored > 0:
+                            rows[key] = (stored,)
+                        else:
+                            rows.pop(key, None)
+                else:
+                    upserts, deleted = change
+                    rows.update(upserts)
+                    for key in deleted:
+                        rows.pop(key, None)
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._flusher_pid == os.getpid() and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher_pid == os.getpid() and self._flusher.is_alive():
+                return
+            self._stop.clear()
+            self._flusher = threading.Thread(target=self._run, name='player-cache-flusher', daemon=True)
+            self._flusher_pid = os.getpid()
+            self._flusher.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Player cache flush failed: {e}")
+
+    def shutdown(self):
+        self._stop.set()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Player cache final flush failed: {e}")
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one execution.
+
+    The first caller runs the function; callers arriving while it is in
+    flight wait and receive the same result (or exception), so results
+    must be treated as read-only.
+    """
+
+    class _Call:
+        __slots__ = ('done', 'result', 'error')
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error: Optional[BaseException] = None
+
+    def __init__(self):
+        self._calls: Dict[Any, 'SingleFlight._Call'] = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key, func, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
         
-        conn.commit()
-        conn.close()
+        try:
+            call.result = func(*args)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class CacheBus:
+    """Cross-process invalidation for the player cache, leaderboard and auction books.
+
+    Writers append events to `cache_events` in the shared database, inside
+    the transaction that made the change; every process polls for events
+    from other origins every `interval` seconds and drops or refreshes its
+    copies. Because the database is the channel, it works the same for
+    gunicorn workers on one SQLite file and for nodes sharing PostgreSQL.
+    A short look-back window catches events whose ids committed out of
+    order. Disabled (every call a no-op) when CACHE_BUS=off.
+    """
+
+    LOOKBACK = 200
+    BATCH = 1000
+
+    def __init__(self, enabled: bool, interval: float, retention: float):
+        self.enabled = enabled
+        self.interval = interval
+        self.retention = retention
+        self.received = 0
+        self._last_id = 0
+        self._seen: OrderedDict = OrderedDict()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._origin = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    @property
+    def origin(self) -> str:
+        if self._pid != os.getpid() or self._origin is None:
+            self._origin = f'{socket.gethostname()}:{os.getpid()}:{os.urandom(4).hex()}'
+            self._pid = os.getpid()
+        return self._origin
+
+    def publish(self, conn=None, players=(), auction_add=(), auction_remove=(), reload: bool = False):
+        """Record a change for other processes; pass `conn` to commit with the change itself."""
+        if not self.enabled:
+            return
+        payload = {key: value for key, value in (
+            ('players', list(players)), ('auction_add', list(auction_add)),
+            ('auction_remove', list(auction_remove)), ('reload', reload),
+        ) if value}
+        if not payload:
+            return
+        params = (self.origin, json.dumps(payload), time.time())
+        if conn is not None:
+            conn.execute('INSERT INTO cache_events (origin, payload, created_at) VALUES (?, ?, ?)', params)
+        else:
+            with Database.connection() as conn:
+                conn.execute('INSERT INTO cache_events (origin, payload, created_at) VALUES (?, ?, ?)', params)
+
+    def start(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            with Database.connection() as conn:
+                self._last_id = conn.execute('SELECT COALESCE(MAX(event_id), 0) FROM cache_events').fetchone()[0]
+            self._spawn()
+
+    def _spawn(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='cache-bus', daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        # Keep the parent's position so events between its last poll and the fork still apply here
+        self._lock = threading.Lock()
+        if self._thread is not None:
+            self._spawn()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        polls = 0
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+                polls += 1
+                if polls % 240 == 0:
+                    with Database.connection() as conn:
+                        conn.execute('DELETE FROM cache_events WHERE created_at < ?', (time.time() - self.retention,))
+            except Exception as e:
+                logger.error(f"Cache bus poll failed: {e}")
+
+    def poll(self) -> int:
+        """Apply pending events from other processes; returns how many were applied."""
+        with Database.connection() as conn:
+            rows = conn.execute(
+                'SELECT event_id, origin, payload FROM cache_events WHERE event_id > ? ORDER BY event_id LIMIT ?',
+                (max(0, self._last_id - self.LOOKBACK), self.BATCH)
+            ).fetchall()
+        players, added, removed, reload = set(), [], [], False
+        origin = self.origin
+        applied = 0
+        for row in rows:
+            event_id = row['event_id']
+            self._last_id = max(self._last_id, event_id)
+            if event_id in self._seen:
+                continue
+            self._seen[event_id] = None
+            if len(self._seen) > self.LOOKBACK * 4:
+                self._seen.popitem(last=False)
+            if row['origin'] == origin:
+                continue
+            payload = json.loads(row['payload'])
+            players.update(payload.get('players', ()))
+            added.extend(payload.get('auction_add', ()))
+            removed.extend(payload.get('auction_remove', ()))
+            reload = reload or payload.get('reload', False)
+            applied += 1
+        if applied:
+            self.received += applied
+            self._apply(players, added, removed, reload)
+        return applied
+
+    @staticmethod
+    def _apply(players: set, added: List[Dict], removed: List[int], reload: bool):
+        if reload:
+            with player_cache.exclusive():
+                pass
+            rankings.reload()
+            auction_house.reload()
+            return
+        for user_id in players:
+            player_cache.invalidate(user_id)
+        rankings.refresh(list(players))
+        for listing in added:
+            auction_house.add(listing)
+        for listing_id in removed:
+            auction_house.remove(listing_id)
+
+
+class Database:
+    backend = create_backend(DATABASE_URL, DB_PATH)
+
+    @staticmethod
+    @contextmanager
+    def connection():
+        """Autocommit connection for single statements and plain reads."""
+        conn = Database.backend.acquire()
+        try:
+            yield conn
+        finally:
+            Database.backend.release(conn)
+
+    @staticmethod
+    @contextmanager
+    def transaction(immediate: bool = False):
+        """Connection inside BEGIN/COMMIT, rolled back on error.
+
+        `immediate` takes the write lock up front so read-modify-write
+        sequences cannot be interleaved with another writer. Nested calls
+        join the outer transaction.
+        """
+        backend = Database.backend
+        conn = backend.acquire()
+        try:
+            if backend.in_transaction(conn):
+                yield conn
+                return
+            backend.begin(conn, immediate)
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+        finally:
+            backend.release(conn)
+
+    @staticmethod
+    def init():
+        """Create the schema and apply migrations, unless the file is already current."""
+        with Database.connection() as conn:
+            current = Database.backend.schema_version(conn)
+        if current >= Migrations.STEPS[-1][0]:
+            online_migrator.start()
+            return
+        
+        with Database.transaction(immediate=True) as conn:
+            Database.backend.lock_schema(conn)
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS players (
+                    user_id INTEGER PRIMARY KEY,
+                    username TEXT UNIQUE,
+                    class_type TEXT NOT NULL,
+                    level INTEGER DEFAULT 1,
+                    exp INTEGER DEFAULT 0,
+                    health INTEGER NOT NULL,
+                    max_health INTEGER NOT NULL,
+                    mana INTEGER NOT NULL,
+                    max_mana INTEGER NOT NULL,
+                    attack INTEGER NOT NULL,
+                    defense INTEGER NOT NULL,
+                    crit_chance REAL NOT NULL,
+                    dodge_chance REAL NOT NULL,
+                    crit_damage REAL NOT NULL,
+                    gold INTEGER NOT NULL,
+                    inventory TEXT DEFAULT '{}',
+                    equipment TEXT DEFAULT '{}',
+                    kills INTEGER DEFAULT 0,
+                    battles_won INTEGER DEFAULT 0,
+                    battles_lost INTEGER DEFAULT 0,
+                    damage_dealt INTEGER DEFAULT 0,
+                    total_exp INTEGER DEFAULT 0,
+                    skill_cooldowns TEXT DEFAULT '{}',
+                    achievements TEXT DEFAULT '{}',
+                    daily_quests TEXT DEFAULT '{}',
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            ''')
+        
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_players_rank
+                ON players (level DESC, total_exp DESC, user_id, username, class_type, gold, kills, battles_won, damage_dealt)
+            ''')
+        
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS battles (
+                    battle_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    enemy_name TEXT,
+                    won BOOLEAN,
+                    damage_dealt INTEGER,
+                    damage_taken INTEGER,
+                    battle_date TEXT,
+                    duration INTEGER
+                )
+            ''')
+        
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_battles_user_date ON battles (user_id, battle_date DESC)
+            ''')
+        
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS auction_items (
+                    item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    seller_id INTEGER,
+                    item_name TEXT,
+                    item_data TEXT,
+                    price INTEGER,
+                    created_at TEXT
+                )
+            ''')
+        
+            Migrations.apply(conn)
+        
+        online_migrator.start()
 
     @staticmethod
     def player_exists(user_id: int) -> bool:
-        conn = sqlite3.connect('runequestrpg.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id FROM players WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone() is not None
-        conn.close()
-        return result
+        if player_cache.contains(user_id):
+            return True
+        with Database.connection() as conn:
+            cursor = conn.execute('SELECT 1 FROM players WHERE user_id = ?', (user_id,))
+            return cursor.fetchone() is not None
 
     @staticmethod
     def create_player(user_id: int, class_type: str, username: str) -> bool:
@@ -190,107 +1808,252 @@ class Database:
             return False
         
         cls = CLASSES[class_type]
-        conn = sqlite3.connect('runequestrpg.db')
-        cursor = conn.cursor()
         
         try:
             now = datetime.now().isoformat()
             daily_quests = {quest_id: {"progress": 0, "completed": False} for quest_id in DAILY_QUESTS}
             
-            cursor.execute('''
-                INSERT INTO players (user_id, username, class_type, level, exp, health, max_health, mana, max_mana,
-                                   attack, defense, crit_chance, dodge_chance, crit_damage, gold,
-                                   inventory, equipment, skill_cooldowns, daily_quests, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                user_id, username, class_type, 1, 0,
-                cls['health'], cls['health'],
-                cls['mana'], cls['mana'],
-                cls['attack'], cls['defense'],
-                cls['crit_chance'], cls['dodge_chance'], cls['crit_damage'],
-                cls['starting_gold'],
-                json.dumps({}), json.dumps({}), json.dumps({}),
-                json.dumps(daily_quests), now, now
-            ))
-            conn.commit()
-            conn.close()
+            with Database.transaction() as conn:
+                conn.execute('''
+                    INSERT INTO players (user_id, username, class_type, level, exp, health, max_health, mana, max_mana,
+                                       attack, defense, crit_chance, dodge_chance, crit_damage, gold,
+                                       normalized, quests_date, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?, ?)
+                ''', (
+                    user_id, username, class_type, 1, 0,
+                    cls['health'], cls['health'],
+                    cls['mana'], cls['mana'],
+                    cls['attack'], cls['defense'],
+                    cls['crit_chance'], cls['dodge_chance'], cls['crit_damage'],
+                    cls['starting_gold'],
+                    date.today().isoformat(), now, now
+                ))
+                quests = CHILD_TABLES[-1]
+                quests.write(conn, user_id, quests.to_rows(daily_quests))
+                cache_bus.publish(conn, players=[user_id])
+            rankings.update({
+                'user_id': user_id, 'username': username, 'class_type': class_type,
+                'level': 1, 'gold': cls['starting_gold'],
+            })
             return True
         except Exception as e:
             logger.error(f"Error creating player: {e}")
-            conn.close()
             return False
 
     @staticmethod
-    def get_player(user_id: int) -> Optional[Dict]:
-        conn = sqlite3.connect('runequestrpg.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM players WHERE user_id = ?', (user_id,))
-        row = cursor.fetchone()
-        conn.close()
-        
-        if not row:
-            return None
+    def get_player(user_id: int) -> Optional[Player]:
+        player = player_cache.get(user_id)
+        if player is None:
+            loaded = player_loads.do(user_id, Database.load_player, user_id)
+            if loaded is None:
+                return None
+            player = player_cache.put(user_id, loaded)
         
-        player = dict(row)
-        player['inventory'] = json.loads(player['inventory'])
-        player['equipment'] = json.loads(player['equipment'])
-        player['skill_cooldowns'] = json.loads(player['skill_cooldowns'])
-        player['achievements'] = json.loads(player['achievements'])
-        player['daily_quests'] = json.loads(player['daily_quests'])
+        if quest_engine.refresh(player):
+            Database.save_player(user_id, player)
         return player
 
     @staticmethod
-    def save_player(user_id: int, data: Dict):
-        conn = sqlite3.connect('runequestrpg.db')
-        cursor = conn.cursor()
-        
-        inventory = data.get('inventory', {})
-        equipment = data.get('equipment', {})
-        skill_cooldowns = data.get('skill_cooldowns', {})
-        achievements = data.get('achievements', {})
-        daily_quests = data.get('daily_quests', {})
-        
-        cursor.execute('''
-            UPDATE players SET health = ?, mana = ?, gold = ?, exp = ?, level = ?,
-                            damage_dealt = ?, kills = ?, battles_won = ?, battles_lost = ?, total_exp = ?,
-                            attack = ?, defense = ?, crit_chance = ?, dodge_chance = ?,
-                            inventory = ?, equipment = ?, skill_cooldowns = ?, achievements = ?,
-                            daily_quests = ?, updated_at = ?
-            WHERE user_id = ?
-        ''', (
-            data.get('health', 0), data.get('mana', 0), data.get('gold', 0),
-            data.get('exp', 0), data.get('level', 1),
-            data.get('damage_dealt', 0), data.get('kills', 0),
-            data.get('battles_won', 0), data.get('battles_lost', 0),
-            data.get('total_exp', 0),
-            data.get('attack', 0), data.get('defense', 0),
-            data.get('crit_chance', 0), data.get('dodge_chance', 0),
-            json.dumps(inventory), json.dumps(equipment),
-            json.dumps(skill_cooldowns), json.dumps(achievements),
-            json.dumps(daily_quests), datetime.now().isoformat(),
-            user_id
-        ))
-        conn.commit()
-        conn.close()
-
-    @staticmethod
-    def get_leaderboard(limit: int = 50) -> List[Dict]:
-        conn = sqlite3.connect('runequestrpg.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT user_id, username, class_type, level, total_exp, gold, kills, battles_won, damage_dealt
-            FROM players ORDER BY level DESC, total_exp DESC LIMIT ?
-        ''', (limit,))
-        leaders = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return leaders
+    def load_player(user_id: int) -> Optional[Player]:
+        with Database.connection() as conn:
+            cursor = conn.execute(f'SELECT {", ".join(PLAYER_COLUMNS)}, normalized FROM players WHERE user_id = ?',
+                                  (user_id,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            
+            if not row['normalized']:
+                with Database.transaction(immediate=True):
+                    OnlineMigrator.normalize_player(conn, user_id)
+            
+            return Player.from_row(row, {table.field: table.load(conn, user_id) for table in CHILD_TABLES})
+
+    @staticmethod
+    def save_player(user_id: int, data: Player):
+        """Stage `data` in the player cache; the flusher persists it."""
+        player_cache.update(user_id, data)
+        player = player_cache.get(user_id)
+        if player is not None:
+            rankings.update(player)
+
+    @staticmethod
+    def write_columns(conn: sqlite3.Connection, user_id: int, columns: Dict[str, Any], additive=()):
+        """UPDATE only the given scalar columns of one player (and updated_at).
+
+        Columns named in `additive` hold increments rather than new values.
+        """
+        assignments = ''.join(
+            f'{column} = {column} + ?, ' if column in additive else f'{column} = ?, ' for column in columns
+        )
+        conn.execute(
+            f'UPDATE players SET {assignments}updated_at = ? WHERE user_id = ?',
+            (*columns.values(), datetime.now().isoformat(), user_id)
+        )
+
+    @staticmethod
+    def get_leaderboard(limit: int = 50, board: str = 'level', offset: int = 0) -> List[Dict]:
+        return rankings.page(board, offset, limit)
+
+    @staticmethod
+    def get_battles(user_id: int, limit: int = 20, offset: int = 0) -> List[Dict]:
+        with Database.connection() as conn:
+            cursor = conn.execute('''
+                SELECT battle_id, enemy_name, won, damage_dealt, damage_taken, battle_date, duration
+                FROM battles WHERE user_id = ? ORDER BY battle_date DESC LIMIT ? OFFSET ?
+            ''', (user_id, limit, offset))
+            return [{**dict(row), 'won': bool(row['won'])} for row in cursor.fetchall()]
+
+
+player_cache = PlayerCache(PLAYER_CACHE_SIZE, PLAYER_FLUSH_INTERVAL)
+atexit.register(player_cache.shutdown)
+online_migrator = OnlineMigrator()
+player_loads = SingleFlight()
+cache_bus = CacheBus(CACHE_BUS != 'off', CACHE_BUS_INTERVAL, CACHE_BUS_RETENTION)
+atexit.register(cache_bus.stop)
+metrics.register_counter('runequest_cache_bus_events_total', lambda: cache_bus.received)
+metrics.register_counter('runequest_player_loads_coalesced_total', lambda: player_loads.shared)
+metrics.instrument(Database, 'runequest_db_call_seconds', exclude=('connection', 'transaction'))
 
 Database.init()
 
+# ===================== LEADERBOARD =====================
+
+class RankedBoard:
+    """Players ordered by a sort key, kept sorted with bisect.
+
+    Keys are tuples whose first items are negated scores, so ascending order
+    is best-first; the trailing user_id breaks ties deterministically.
+    """
+
+    def __init__(self, key_func):
+        self.key_func = key_func
+        self._keys: List[Tuple] = []
+        self._by_user: Dict[int, Tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def update(self, row: Dict):
+        key = self.key_func(row) + (row['user_id'],)
+        old = self._by_user.get(row['user_id'])
+        if old == key:
+            return
+        if old is not None:
+            del self._keys[bisect.bisect_left(self._keys, old)]
+        bisect.insort(self._keys, key)
+        self._by_user[row['user_id']] = key
+
+    def rank(self, user_id: int) -> Optional[int]:
+        key = self._by_user.get(user_id)
+        if key is None:
+            return None
+        return bisect.bisect_left(self._keys, key) + 1
+
+    def page(self, offset: int, limit: int) -> List[int]:
+        return [key[-1] for key in self._keys[offset:offset + limit]]
+
+
+class Leaderboard:
+    """In-memory rankings for every board, built once from SQLite.
+
+    Saves push the player's new summary row in; reads never touch the
+    database after the initial load.
+    """
+
+    FIELDS = ('user_id', 'username', 'class_type', 'level', 'total_exp', 'gold', 'kills', 'battles_won', 'damage_dealt')
+    BOARDS = {
+        'level': lambda row: (-row['level'], -row['total_exp']),
+        'kills': lambda row: (-row['kills'],),
+        'gold': lambda row: (-row['gold'],),
+        'damage_dealt': lambda row: (-row['damage_dealt'],),
+    }
+
+    def __init__(self):
+        self._rows: Dict[int, Dict] = {}
+        self._boards = {name: RankedBoard(key_func) for name, key_func in self.BOARDS.items()}
+        self._lock = threading.RLock()
+        self._loaded = False
+
+    @property
+    def loaded(self) -> bool:
+        """Whether reads are served from memory, i.e. will not touch the database."""
+        return self._loaded
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            player_cache.flush()
+            with Database.connection() as conn:
+                cursor = conn.execute(f'SELECT {", ".join(self.FIELDS)} FROM players')
+                for row in cursor:
+                    self._apply(dict(row))
+            self._loaded = True
+
+    def _apply(self, row: Dict):
+        self._rows[row['user_id']] = row
+        for board in self._boards.values():
+            board.update(row)
+
+    def update(self, player: Dict):
+        row = {field: player.get(field, 0) for field in self.FIELDS}
+        with self._lock:
+            if not self._loaded:
+                return
+            if self._rows.get(row['user_id']) != row:
+                self._apply(row)
+
+    def refresh(self, user_ids: List[int]):
+        """Re-read the summary rows of players that are not in this process's cache."""
+        if not self._loaded or not user_ids:
+            return
+        with Database.connection() as conn:
+            for offset in range(0, len(user_ids), 500):
+                chunk = user_ids[offset:offset + 500]
+                cursor = conn.execute(
+                    f'SELECT {", ".join(self.FIELDS)} FROM players WHERE user_id IN ({", ".join("?" * len(chunk))})',
+                    chunk
+                )
+                for row in cursor.fetchall():
+                    self.update(dict(row))
+
+    def page(self, board: str = 'level', offset: int = 0, limit: int = 50) -> List[Dict]:
+        self._ensure_loaded()
+        with self._lock:
+            return [dict(self._rows[user_id]) for user_id in self._boards[board].page(offset, limit)]
+
+    def rank(self, user_id: int, board: str = 'level') -> Optional[int]:
+        self._ensure_loaded()
+        with self._lock:
+            return self._boards[board].rank(user_id)
+
+    def size(self) -> int:
+        self._ensure_loaded()
+        return len(self._rows)
+
+    def reload(self):
+        """Forget everything; the next read rebuilds from the database."""
+        with self._lock:
+            self._rows.clear()
+            self._boards = {name: RankedBoard(key_func) for name, key_func in self.BOARDS.items()}
+            self._loaded = False
+
+
+rankings = Leaderboard()
+
 # ===================== COMBAT SYSTEM =====================
 
+CATEGORY_SLOTS = {"weapons": "weapon", "armor": "armor", "accessories": "accessory", "potions": None}
+
+# id -> item, annotated with its shop category and equipment slot
+ITEM_INDEX = {
+    item["id"]: {**item, "category": category, "slot": CATEGORY_SLOTS.get(category)}
+    for category, items in ITEMS.items()
+    for item in items
+}
+
 class CombatSystem:
     @staticmethod
     def calculate_damage(attacker: Dict, defender: Dict, is_skill: bool = False) -> Dict:
@@ -310,19 +2073,26 @@ class CombatSystem:
         
         return {'damage': final_damage, 'is_crit': is_crit}
     
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def equipment_bonuses(signature: Tuple[Tuple[str, str], ...]) -> Dict[str, int]:
+        """Aggregate bonus vector for a sorted (slot, item_id) signature (shared, read-only)."""
+        bonuses = {'attack': 0, 'defense': 0, 'crit': 0, 'dodge': 0}
+        for slot, item_id in signature:
+            item = ITEM_INDEX.get(item_id)
+            if item is None:
+                continue
+            bonuses['attack'] += item.get('attack', 0)
+            bonuses['defense'] += item.get('defense', 0)
+            bonuses['crit'] += item.get('crit', 0)
+            bonuses['dodge'] += item.get('dodge', 0)
+        return bonuses
+    
     @staticmethod
     def apply_equipment_bonuses(player: Dict) -> Dict:
         equipment = player.get('equipment', {})
-        bonuses = {'attack': 0, 'defense': 0, 'crit': 0, 'dodge': 0}
-        
-        for slot, item_id in equipment.items():
-            for category in ITEMS.values():
-                for item in category:
-                    if item['id'] == item_id:
-                        bonuses['attack'] += item.get('attack', 0)
-                        bonuses['defense'] += item.get('defense', 0)
-                        bonuses['crit'] += item.get('crit', 0)
-                        bonuses['dodge'] += item.get('dodge', 0)
+        signature = tuple(sorted((str(slot), str(item_id)) for slot, item_id in equipment.items()))
+        bonuses = CombatSystem.equipment_bonuses(signature)
         
         player['attack'] += bonuses['attack']
         player['defense'] += bonuses['defense']
@@ -331,9 +2101,923 @@ class CombatSystem:
         
         return player
 
+# ===================== PROGRESSION =====================
+
+class Progression:
+    """Level thresholds and per-class stat curves for levels 1..max_level.
+
+    `thresholds[i]` is the cumulative exp needed to reach level i + 1
+    (LEVEL_UP_EXP * level to advance from `level`), so any exp total
+    resolves to a level with one bisect. Stats are looked up from the
+    class curve for the level instead of being grown incrementally.
+    """
+
+    STATS = (('max_health', 'health'), ('max_mana', 'mana'), ('attack', 'attack'), ('defense', 'defense'))
+
+    def __init__(self, classes: Dict[str, Dict], max_level: int):
+        self.max_level = max_level
+        self.thresholds = [LEVEL_UP_EXP * level * (level - 1) // 2 for level in range(1, max_level + 1)]
+        self.curves = {
+            class_type: [
+                {stat: int(cls[base] * BASE_STAT_MULTIPLIER ** (level - 1)) for stat, base in self.STATS}
+                for level in range(1, max_level + 1)
+            ]
+            for class_type, cls in classes.items()
+        }
+
+    def stats(self, class_type: str, level: int) -> Dict[str, int]:
+        return self.curves[class_type][min(level, self.max_level) - 1]
+
+    def level_for(self, cumulative_exp: int) -> int:
+        return min(bisect.bisect_right(self.thresholds, cumulative_exp), self.max_level)
+
+    def resolve(self, player: Dict) -> int:
+        """Apply any level-ups the player's exp covers; returns levels gained.
+
+        Base stats are set from the class curve for the new level, and
+        health and mana are refilled when the level changes.
+        """
+        old_level = player['level']
+        cumulative = self.thresholds[min(old_level, self.max_level) - 1] + player['exp']
+        level = max(old_level, self.level_for(cumulative))
+        if level == old_level:
+            return 0
+        
+        player['level'] = level
+        player['exp'] = cumulative - self.thresholds[level - 1]
+        player.update(self.stats(player['class_type'], level))
+        player['health'] = player['max_health']
+        player['mana'] = player['max_mana']
+        return level - old_level
+
+    def recompute_all(self) -> int:
+        """Rewrite level, exp and base stats of every player from the tables.
+
+        Fixes rows whose stats drifted under the old incremental growth or
+        that missed level-ups. Runs as one transaction with the player cache
+        held exclusively. Returns the number of rows changed.
+        """
+        fields = ('level', 'exp') + tuple(stat for stat, _ in self.STATS)
+        with player_cache.exclusive(), Database.transaction(immediate=True) as conn:
+            cache_bus.publish(conn, reload=True)
+            updates = []
+            for row in conn.execute(f'SELECT user_id, class_type, health, mana, {", ".join(fields)} FROM players'):
+                if row['class_type'] not in self.curves:
+                    continue
+                cumulative = self.thresholds[min(row['level'], self.max_level) - 1] + row['exp']
+                level = self.level_for(cumulative)
+                values = {'level': level, 'exp': cumulative - self.thresholds[level - 1]}
+                values.update(self.stats(row['class_type'], level))
+                if any(row[field] != values[field] for field in fields):
+                    updates.append((*(values[field] for field in fields),
+                                    min(row['health'], values['max_health']), min(row['mana'], values['max_mana']),
+                                    row['user_id']))
+            conn.executemany(
+                f'''UPDATE players SET {", ".join(f"{field} = ?" for field in fields)}, health = ?, mana = ?
+                    WHERE user_id = ?''',
+                updates
+            )
+        rankings.reload()
+        return len(updates)
+
+
+progression = Progression(CLASSES, MAX_LEVEL)
+
+# ===================== QUESTS & ACHIEVEMENTS =====================
+
+class QuestEngine:
+    """Daily quests and achievements compiled into per-event trigger tables.
+
+    `emit` only evaluates the rules listening to that event. Daily quests
+    reset lazily: the first access on a new calendar day (compared with the
+    player's stored `quests_date`) starts them over.
+    """
+
+    EVENTS = ('kill', 'gold_gained', 'exp_gained', 'level_up')
+
+    def __init__(self, daily_quests: Dict[str, Dict], achievements: Dict[str, Dict]):
+        self.quests: Dict[str, List[Tuple[str, Dict]]] = {event: [] for event in self.EVENTS}
+        self.achievements: Dict[str, List[Tuple[str, Dict]]] = {event: [] for event in self.EVENTS}
+        for quest_id, quest in daily_quests.items():
+            self.quests[QUEST_EVENTS[quest['type']]].append((quest_id, quest))
+        for achievement_id, achievement in achievements.items():
+            self.achievements[achievement['event']].append((achievement_id, achievement))
+        self.quest_ids = tuple(daily_quests)
+
+    def refresh(self, player: Dict, today: Optional[str] = None) -> bool:
+        """Reset daily quests if they belong to an earlier day. Returns True if changed."""
+        today = today or date.today().isoformat()
+        quests = player['daily_quests']
+        if player.get('quests_date') == today and all(quest_id in quests for quest_id in self.quest_ids):
+            return False
+        if player.get('quests_date') != today:
+            quests.clear()
+        for quest_id in self.quest_ids:
+            quests.setdefault(quest_id, {'progress': 0, 'completed': False})
+        player['quests_date'] = today
+        return True
+
+    def emit(self, player: Dict, event: str, amount: int = 1) -> List[str]:
+        """Apply one event to the player; returns ids of quests/achievements it completed."""
+        unlocked = []
+        for quest_id, quest in self.quests[event]:
+            state = player['daily_quests'].setdefault(quest_id, {'progress': 0, 'completed': False})
+            if state['completed']:
+                continue
+            state['progress'] += amount
+            if state['progress'] >= quest['target']:
+                state['completed'] = True
+                unlocked.append(quest_id)
+                player['gold'] += quest['reward']
+                unlocked += self.emit(player, 'gold_gained', quest['reward'])
+        
+        for achievement_id, achievement in self.achievements[event]:
+            if player['achievements'].get(achievement_id):
+                continue
+            if player.get(achievement['stat'], 0) >= achievement['target']:
+                player['achievements'][achievement_id] = True
+                unlocked.append(achievement_id)
+        return unlocked
+
+
+quest_engine = QuestEngine(DAILY_QUESTS, ACHIEVEMENTS)
+
+# ===================== BATTLE SESSIONS =====================
+
+class BattleSession:
+    """State of one fight, owned by the server for its whole duration.
+
+    Effective player stats (equipment included) are computed once at the
+    start; attacks only mutate this object. Skills are paid for with the
+    session's mana, which like health is refilled when the battle ends.
+    Nothing is persisted until the battle is resolved in /api/battle-end.
+    """
+
+    def __init__(self, user_id: int, enemy_id: str, player: Dict):
+        self.user_id = user_id
+        self.enemy_id = enemy_id
+        self.enemy = dict(ENEMIES[enemy_id])
+        self.enemy_health = self.enemy['hp']
+        self.stats = CombatSystem.apply_equipment_bonuses(player)
+        self.player_health = max(1, self.stats['health'])
+        self.player_mana = max(0, self.stats['mana'])
+        self.damage_dealt = 0
+        self.damage_taken = 0
+        self.started_at = self.last_action = time.time()
+        self.lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self.enemy_health <= 0 or self.player_health <= 0
+
+    @property
+    def won(self) -> bool:
+        return self.enemy_health <= 0 < self.player_health
+
+    @property
+    def skill_ready(self) -> bool:
+        return self.player_mana >= SKILL_MANA_COST
+
+    def enemy_turn(self) -> int:
+        damage = max(1, int(self.enemy['damage'] - self.stats['defense'] / 2))
+        self.player_health = max(0, self.player_health - damage)
+        self.damage_taken += damage
+        return damage
+
+    def attack(self, is_skill: bool = False) -> Dict:
+        if is_skill:
+            self.player_mana -= SKILL_MANA_COST
+        result = CombatSystem.calculate_damage(self.stats, self.enemy, is_skill)
+        self.enemy_health = max(0, self.enemy_health - result['damage'])
+        self.damage_dealt += result['damage']
+        if not self.finished:
+            result['enemy_damage'] = self.enemy_turn()
+        return result
+
+    def to_dict(self) -> Dict:
+        return {
+            'enemy_id': self.enemy_id,
+            'enemy': self.enemy,
+            'enemy_health': self.enemy_health,
+            'enemy_max_health': self.enemy['hp'],
+            'player_health': self.player_health,
+            'player_max_health': self.stats['max_health'],
+            'player_mana': self.player_mana,
+            'player_max_mana': self.stats['max_mana'],
+            'skill_ready': self.skill_ready,
+            'damage_dealt': self.damage_dealt,
+            'damage_taken': self.damage_taken,
+            'finished': self.finished,
+            'won': self.won,
+        }
+
+
+class BattleManager:
+    """Active battle sessions by user_id, expired after `ttl` seconds idle.
+
+    Sessions live in process memory, so a user's requests must reach the
+    worker that started the battle.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._sessions: Dict[int, BattleSession] = {}
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for user_id in [uid for uid, s in self._sessions.items() if s.last_action < cutoff]:
+            del self._sessions[user_id]
+
+    def start(self, user_id: int, enemy_id: str, player: Dict) -> BattleSession:
+        session = BattleSession(user_id, enemy_id, player)
+        with self._lock:
+            self._expire()
+            self._sessions[user_id] = session
+        return session
+
+    def get(self, user_id: int) -> Optional[BattleSession]:
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                return None
+            now = time.time()
+            if session.last_action < now - self.ttl:
+                del self._sessions[user_id]
+                return None
+            session.last_action = now
+            return session
+
+    def finish(self, user_id: int) -> Optional[BattleSession]:
+        with self._lock:
+            return self._sessions.pop(user_id, None)
+
+
+battles = BattleManager(BATTLE_SESSION_TTL)
+
+# ===================== BATTLE LOG =====================
+
+class BattleLog:
+    """Buffered writer for the battles table.
+
+    battle_end only enqueues a row; a background thread drains the queue and
+    inserts rows with executemany, one transaction per batch, as soon as
+    `batch_size` rows are waiting or `flush_interval` seconds have passed.
+    When the queue is full producers wait up to `put_timeout` seconds and
+    the record is dropped (and counted) if there is still no room.
+    """
+
+    COLUMNS = ('user_id', 'enemy_name', 'won', 'damage_dealt', 'damage_taken', 'battle_date', 'duration')
+
+    def __init__(self, maxsize: int, batch_size: int, flush_interval: float, put_timeout: float = 0.05):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._writer: Optional[threading.Thread] = None
+        self._writer_pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def record(self, user_id: int, enemy_name: str, won: bool, damage_dealt: int, damage_taken: int, duration: int):
+        row = (user_id, enemy_name, won, damage_dealt, damage_taken, datetime.now().isoformat(), duration)
+        self._ensure_writer()
+        try:
+            self._queue.put(row, timeout=self.put_timeout)
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"Battle log queue full, dropped record for {user_id} ({self.dropped} total)")
+
+    def _ensure_writer(self):
+        if self._writer is not None and self._writer_pid == os.getpid() and self._writer.is_alive():
+            return
+        with self._lock:
+            if self._writer is not None and self._writer_pid == os.getpid() and self._writer.is_alive():
+                return
+            self._stop.clear()
+            self._writer = threading.Thread(target=self._run, name='battle-log-writer', daemon=True)
+            self._writer_pid = os.getpid()
+            self._writer.start()
+
+    def _take_batch(self, block: bool) -> List[Tuple]:
+        """Up to batch_size rows; when blocking, wait at most flush_interval in total."""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                if block:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[Tuple]):
+        with Database.transaction() as conn:
+            conn.executemany(
+                f'INSERT INTO battles ({", ".join(self.COLUMNS)}) VALUES ({", ".join("?" * len(self.COLUMNS))})',
+                batch
+            )
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._take_batch(block=True)
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    logger.error(f"Battle log write of {len(batch)} rows failed: {e}")
+
+    def flush(self) -> int:
+        """Synchronously write everything currently queued."""
+        written = 0
+        while True:
+            batch = self._take_batch(block=False)
+            if not batch:
+                return written
+            self._write(batch)
+            written += len(batch)
+
+    def shutdown(self):
+        self._stop.set()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Battle log final flush failed: {e}")
+
+
+battle_log = BattleLog(BATTLE_LOG_QUEUE_SIZE, BATTLE_LOG_BATCH_SIZE, BATTLE_LOG_FLUSH_INTERVAL)
+atexit.register(battle_log.shutdown)
+
+# ===================== ECONOMY =====================
+
+class EconomyError(Exception):
+    """Aborts an economy transaction; the message is returned to the client."""
+
+
+class Economy:
+    """Gold and item transfers as conditional SQL in short write transactions.
+
+    Every check-and-change is a single UPDATE with its precondition in the
+    WHERE clause (`gold >= ?`, `quantity >= 1`, listing still present), run
+    inside BEGIN IMMEDIATE, so concurrent requests can never spend the same
+    gold or sell the same listing twice. Pending cached changes of the
+    paying player are flushed first. Afterwards the committed deltas are
+    mirrored into the player cache; the cache writes gold and inventory as
+    increments, so both paths commute.
+    """
+
+    @staticmethod
+    def _run(user_ids: Tuple[int, ...], operation) -> Dict:
+        for user_id in user_ids:
+            player_cache.flush_player(user_id)
+        try:
+            with Database.transaction(immediate=True) as conn:
+                result, deltas = operation(conn)
+                cache_bus.publish(conn, players=deltas.keys(), auction_add=result.get('listings_added', ()),
+                                  auction_remove=result.get('listings_removed', ()))
+        except EconomyError as e:
+            return {'error': str(e)}
+        
+        uncached = []
+        for user_id, (gold, items) in deltas.items():
+            player_cache.apply_delta(user_id, gold, items)
+            player = player_cache.get(user_id)
+            if player is not None:
+                rankings.update(player)
+            else:
+                uncached.append(user_id)
+        rankings.refresh(uncached)
+        return result
+
+    @staticmethod
+    def _take_gold(conn: sqlite3.Connection, user_id: int, amount: int, min_level: int = 0):
+        cursor = conn.execute(
+            'UPDATE players SET gold = gold - ? WHERE user_id = ? AND gold >= ? AND level >= ?',
+            (amount, user_id, amount, min_level)
+        )
+        if cursor.rowcount == 0:
+            row = conn.execute('SELECT level FROM players WHERE user_id = ?', (user_id,)).fetchone()
+            if row is None:
+                raise EconomyError('Player not found')
+            if row['level'] < min_level:
+                raise EconomyError(f'Need level {min_level}')
+            raise EconomyError('Not enough gold')
+
+    @staticmethod
+    def buy_item(user_id: int, item: Dict) -> Dict:
+        inventory = CHILD_TABLES[0]
+        
+        def operation(conn):
+            Economy._take_gold(conn, user_id, item['price'], item.get('level_req', 0))
+            inventory.write_deltas(conn, user_id, {item['id']: 1})
+            return {'success': True}, {user_id: (-item['price'], {item['id']: 1})}
+        
+        result = Economy._run((user_id,), operation)
+        if 'success' in result:
+            result['gold'] = Database.get_player(user_id)['gold']
+        return result
+
+    @staticmethod
+    def list_item(user_id: int, item_id: str, price: int) -> Dict:
+        item = ITEM_INDEX[item_id]
+        
+        def operation(conn):
+            cursor = conn.execute(
+                'UPDATE player_items SET quantity = quantity - 1 WHERE user_id = ? AND item_id = ? AND quantity >= 1',
+                (user_id, item_id)
+            )
+            if cursor.rowcount == 0:
+                raise EconomyError('Item not in inventory')
+            conn.execute('DELETE FROM player_items WHERE user_id = ? AND item_id = ? AND quantity <= 0', (user_id, item_id))
+            listing_id = conn.execute(
+                '''INSERT INTO auction_items (seller_id, item_name, item_data, price, created_at) VALUES (?, ?, ?, ?, ?)
+                   RETURNING item_id''',
+                (user_id, item_id, json.dumps({'name': item['name'], 'emoji': item['emoji']}), price, created_at)
+            ).fetchone()[0]
+            listing = {
+                'listing_id': listing_id, 'seller_id': user_id, 'item_id': item_id,
+                'item_data': {'name': item['name'], 'emoji': item['emoji']}, 'price': price, 'created_at': created_at,
+            }
+            return {'success': True, 'listing_id': listing_id, 'listings_added': [listing]}, {user_id: (0, {item_id: -1})}
+        
+        created_at = datetime.now().isoformat()
+        result = Economy._run((user_id,), operation)
+        if 'success' in result:
+            auction_house.add(result.pop('listings_added')[0])
+        return result
+
+    @staticmethod
+    def buy_listing(user_id: int, listing_id: int) -> Dict:
+        def operation(conn):
+            listing = conn.execute(
+                'SELECT seller_id, item_name, price FROM auction_items WHERE item_id = ?', (listing_id,)
+            ).fetchone()
+            if listing is None:
+                raise EconomyError('Listing not found')
+            if listing['seller_id'] == user_id:
+                raise EconomyError('Cannot buy your own listing')
+            
+            if conn.execute('DELETE FROM auction_items WHERE item_id = ?', (listing_id,)).rowcount == 0:
+                raise EconomyError('Listing not found')
+            Economy._take_gold(conn, user_id, listing['price'])
+            conn.execute('UPDATE players SET gold = gold + ? WHERE user_id = ?', (listing['price'], listing['seller_id']))
+            CHILD_TABLES[0].write_deltas(conn, user_id, {listing['item_name']: 1})
+            
+            result = {'success': True, 'item_id': listing['item_name'], 'listings_removed': [listing_id]}
+            deltas = {
+                user_id: (-listing['price'], {listing['item_name']: 1}),
+                listing['seller_id']: (listing['price'], {}),
+            }
+            return result, deltas
+        
+        result = Economy._run((user_id,), operation)
+        result.pop('listings_removed', None)
+        if 'success' in result or result.get('error') == 'Listing not found':
+            auction_house.remove(listing_id)
+        if 'success' in result:
+            result['gold'] = Database.get_player(user_id)['gold']
+        return result
+
+    @staticmethod
+    def cancel_listing(user_id: int, listing_id: int) -> Dict:
+        def operation(conn):
+            listing = conn.execute(
+                'SELECT item_name FROM auction_items WHERE item_id = ? AND seller_id = ?', (listing_id, user_id)
+            ).fetchone()
+            if listing is None or conn.execute(
+                'DELETE FROM auction_items WHERE item_id = ? AND seller_id = ?', (listing_id, user_id)
+            ).rowcount == 0:
+                raise EconomyError('Listing not found')
+            CHILD_TABLES[0].write_deltas(conn, user_id, {listing['item_name']: 1})
+            result = {'success': True, 'item_id': listing['item_name'], 'listings_removed': [listing_id]}
+            return result, {user_id: (0, {listing['item_name']: 1})}
+        
+        result = Economy._run((user_id,), operation)
+        result.pop('listings_removed', None)
+        if 'success' in result:
+            auction_house.remove(listing_id)
+        return result
+
+    @staticmethod
+    def expire_listings(cutoff: str, limit: int = 500) -> int:
+        """Return listings created before `cutoff` to their sellers."""
+        def operation(conn):
+            # Only rows this statement deleted are credited, so a concurrent sweep or
+            # buy of the same listing cannot hand the item back twice
+            expired = conn.execute(
+                '''DELETE FROM auction_items WHERE item_id IN (
+                       SELECT item_id FROM auction_items WHERE created_at < ? LIMIT ?
+                   ) RETURNING item_id, seller_id, item_name''', (cutoff, limit)
+            ).fetchall()
+            deltas = {}
+            for listing in expired:
+                items = deltas.setdefault(listing['seller_id'], (0, {}))[1]
+                items[listing['item_name']] = items.get(listing['item_name'], 0) + 1
+            for seller_id, (_, items) in deltas.items():
+                CHILD_TABLES[0].write_deltas(conn, seller_id, items)
+            expired_ids = [listing['item_id'] for listing in expired]
+            return {'success': True, 'expired': expired_ids, 'listings_removed': expired_ids}, deltas
+        
+        result = Economy._run((), operation)
+        for listing_id in result.get('expired', []):
+            auction_house.remove(listing_id)
+        return len(result.get('expired', []))
+
+
+class AuctionHouse:
+    """In-memory order books over auction_items, rebuilt from SQLite on first use.
+
+    Each item has its own list of (price, created_at, listing_id) keys kept
+    sorted with bisect, and one global list covers price queries across all
+    items. Economy keeps it in sync on list/buy/cancel/expire; the database
+    stays the source of truth for whether a trade succeeds.
+    """
+
+    def __init__(self, ttl: int, sweep_interval: float):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._listings: Dict[int, Dict] = {}
+        self._books: Dict[str, List[Tuple]] = {}
+        self._all: List[Tuple] = []
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._sweeper: Optional[threading.Thread] = None
+        self._sweeper_pid = None
+
+    @staticmethod
+    def _key(listing: Dict) -> Tuple:
+        return (listing['price'], listing['created_at'], listing['listing_id'])
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            with Database.connection() as conn:
+                cursor = conn.execute(
+                    'SELECT item_id, seller_id, item_name, item_data, price, created_at FROM auction_items'
+                )
+                for row in cursor:
+                    self._insert({
+                        'listing_id': row['item_id'], 'seller_id': row['seller_id'], 'item_id': row['item_name'],
+                        'item_data': json.loads(row['item_data']), 'price': row['price'], 'created_at': row['created_at'],
+                    })
+            self._loaded = True
+
+    def _insert(self, listing: Dict):
+        if listing['listing_id'] in self._listings:
+            return
+        key = self._key(listing)
+        self._listings[listing['listing_id']] = listing
+        bisect.insort(self._books.setdefault(listing['item_id'], []), key)
+        bisect.insort(self._all, key)
+
+    def add(self, listing: Dict):
+        with self._lock:
+            if self._loaded:
+                self._insert(listing)
+
+    def reload(self):
+        """Forget the books; the next read rebuilds them from the database."""
+        with self._lock:
+            self._listings.clear()
+            self._books.clear()
+            self._all.clear()
+            self._loaded = False
+
+    def remove(self, listing_id: int):
+        with self._lock:
+            listing = self._listings.pop(listing_id, None)
+            if listing is None:
+                return
+            key = self._key(listing)
+            book = self._books[listing['item_id']]
+            del book[bisect.bisect_left(book, key)]
+            if not book:
+                del self._books[listing['item_id']]
+            del self._all[bisect.bisect_left(self._all, key)]
+
+    def browse(self, item_id: Optional[str] = None, max_price: Optional[int] = None,
+               offset: int = 0, limit: int = 50) -> List[Dict]:
+        """Cheapest-first listings, optionally for one item and/or at most `max_price`."""
+        return self.search([item_id] if item_id else None, max_price, offset, limit)
+
+    def search(self, item_ids: Optional[List[str]], max_price: Optional[int] = None,
+               offset: int = 0, limit: int = 50) -> List[Dict]:
+        self._ensure_loaded()
+        with self._lock:
+            if item_ids is None:
+                books = [self._all]
+            else:
+                books = [self._books.get(item_id, []) for item_id in item_ids]
+            if max_price is None:
+                ends = [len(book) for book in books]
+            else:
+                ends = [bisect.bisect_right(book, (max_price, chr(0x10FFFF))) for book in books]
+            if len(books) == 1:
+                keys = books[0][offset:min(ends[0], offset + limit)]
+            else:
+                merged = heapq.merge(*(islice(book, end) for book, end in zip(books, ends)))
+                keys = islice(merged, offset, offset + limit)
+            return [dict(self._listings[key[2]]) for key in keys]
+
+    def start(self):
+        """Run the expiry sweeper in this process, if it is not already running.
+
+        Called from serving processes only (first request, gunicorn
+        post_fork, ASGI startup), never at import, so a preloaded gunicorn
+        master does not sweep and fill a player cache of its own.
+        """
+        if self._sweeper is not None and self._sweeper_pid == os.getpid() and self._sweeper.is_alive():
+            return
+        with self._lock:
+            if self._sweeper is not None and self._sweeper_pid == os.getpid() and self._sweeper.is_alive():
+                return
+            self._sweeper = threading.Thread(target=self._sweep, name='auction-sweeper', daemon=True)
+            self._sweeper_pid = os.getpid()
+            self._sweeper.start()
+
+    def _sweep(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                cutoff = (datetime.now() - timedelta(seconds=self.ttl)).isoformat()
+                while Economy.expire_listings(cutoff):
+                    pass
+            except Exception as e:
+                logger.error(f"Auction expiry sweep failed: {e}")
+
+
+auction_house = AuctionHouse(AUCTION_LISTING_TTL, AUCTION_SWEEP_INTERVAL)
+cache_bus.start()
+
+# ===================== STATIC CATALOG =====================
+
+class StaticCatalog:
+    """Pre-serialized responses for the constant game-data endpoints.
+
+    Each catalog is encoded once at startup (plus gzip and, when the brotli
+    package is installed, br variants). Responses carry a strong ETag per
+    encoding and Cache-Control, and If-None-Match is answered with 304.
+    """
+
+    def __init__(self, catalogs: Dict[str, Any], max_age: int):
+        self.cache_control = f'public, max-age={max_age}'
+        self._variants: Dict[str, Dict[str, Tuple[bytes, str]]] = {}
+        for name, data in catalogs.items():
+            body = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+            digest = hashlib.sha256(body).hexdigest()[:32]
+            variants = {'identity': (body, digest), 'gzip': (gzip.compress(body, 9, mtime=0), f'{digest}-gzip')}
+            if brotli is not None:
+                variants['br'] = (brotli.compress(body), f'{digest}-br')
+            self._variants[name] = variants
+
+    def response(self, name: str):
+        variants = self._variants[name]
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in variants and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+        body, etag = variants[encoding]
+        
+        headers = {'ETag': f'"{etag}"', 'Cache-Control': self.cache_control, 'Vary': 'Accept-Encoding'}
+        if any(request.if_none_match.contains(tag) for _, tag in variants.values()) or request.if_none_match.star_tag:
+            return app.response_class(status=304, headers=headers)
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return app.response_class(body, mimetype='application/json', headers=headers)
+
+
+static_catalog = StaticCatalog({
+    'classes': CLASSES,
+    'items': ITEMS,
+    'enemies': ENEMIES,
+    'daily_quests': DAILY_QUESTS,
+    'achievements': ACHIEVEMENTS,
+    'catalog': {
+        'classes': CLASSES,
+        'items': ITEMS,
+        'enemies': ENEMIES,
+        'daily_quests': DAILY_QUESTS,
+        'achievements': ACHIEVEMENTS,
+    },
+}, CATALOG_MAX_AGE)
+
+# ===================== RATE LIMITING =====================
+
+class RateLimiter:
+    """Token buckets per (user_id, route).
+
+    `budgets` maps a route rule to (tokens per second, burst). Buckets that
+    have been idle long enough to be full again are pruned as the table
+    grows, so memory tracks active users only.
+    """
+
+    DEFAULT_BUDGETS = {
+        '/api/create': (0.2, 3),
+        '/api/player': (5, 20),
+        '/api/buy-item': (3, 10),
+        '/api/auction/list': (1, 5),
+        '/api/auction/buy': (3, 10),
+        '/api/auction/cancel': (3, 10),
+        '/api/battle-start': (2, 5),
+        '/api/attack': (6, 15),
+        '/api/flee': (2, 5),
+        '/api/battle-end': (2, 5),
+        '/api/leaderboard/rank': (2, 10),
+        '/api/battles': (2, 10),
+    }
+    PRUNE_THRESHOLD = 100000
+
+    def __init__(self, budgets: Dict[str, Tuple[float, float]]):
+        self.budgets = budgets
+        self.rejected = 0
+        self._buckets: Dict[Tuple[int, str], List[float]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, spec: str) -> Dict[str, Tuple[float, float]]:
+        """Defaults overridden by "route=rate:burst,..." (rate 0 disables a route)."""
+        budgets = dict(cls.DEFAULT_BUDGETS)
+        for entry in filter(None, (part.strip() for part in spec.split(','))):
+            route, _, budget = entry.partition('=')
+            rate, _, burst = budget.partition(':')
+            if float(rate) <= 0:
+                budgets.pop(route, None)
+            else:
+                budgets[route] = (float(rate), float(burst or rate))
+        return budgets
+
+    def allow(self, user_id: int, route: str) -> Tuple[bool, float]:
+        """Take a token; returns (allowed, seconds until the next token)."""
+        budget = self.budgets.get(route)
+        if budget is None:
+            return True, 0.0
+        rate, burst = budget
+        now = time.monotonic()
+        key = (user_id, route)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.PRUNE_THRESHOLD:
+                    self._prune(now)
+                bucket = self._buckets[key] = [burst, now]
+            else:
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return True, 0.0
+            self.rejected += 1
+            return False, (1 - bucket[0]) / rate
+
+    def _prune(self, now: float):
+        full = [key for key, (tokens, last) in self._buckets.items()
+                if tokens + (now - last) * self.budgets[key[1]][0] >= self.budgets[key[1]][1]]
+        for key in full:
+            del self._buckets[key]
+
+
+rate_limiter = RateLimiter(RateLimiter.parse(RATE_LIMITS))
+metrics.register_counter('runequest_rate_limited_total', lambda: rate_limiter.rejected)
+
+# ===================== TELEGRAM BOT =====================
+
+async def start_command(update: 'Update', context: 'ContextTypes.DEFAULT_TYPE'):
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
+
+    keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🎮 Play RuneQuestRPG", web_app=WebAppInfo(url=WEBAPP_URL))]])
+    await update.message.reply_text("⚔️ Welcome to RuneQuestRPG!", reply_markup=keyboard)
+
+
+def build_bot_application() -> 'Application':
+    """Build the bot; the telegram stack is only imported here, not by web workers."""
+    from telegram.ext import Application, CommandHandler
+
+    application = Application.builder().token(BOT_TOKEN).build()
+    application.add_handler(CommandHandler("start", start_command))
+    return application
+
 # ===================== FLASK APP =====================
 
+def json_default(obj: Any) -> Any:
+    if isinstance(obj, Player):
+        return obj.to_dict()
+    if isinstance(obj, (date, datetime)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def select_json_backend(name: str):
+    """(backend name, encode -> bytes, decode) for JSON_BACKEND: auto, orjson, msgspec or stdlib."""
+    if name in ('auto', 'orjson') and orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        return 'orjson', lambda obj: orjson.dumps(obj, default=json_default, option=option), orjson.loads
+    if name in ('auto', 'msgspec') and msgspec is not None:
+        return 'msgspec', msgspec.json.Encoder(enc_hook=json_default).encode, msgspec.json.decode
+    if name not in ('auto', 'stdlib'):
+        logger.warning(f"JSON backend {name} is not available, using stdlib json")
+    encoder = json.JSONEncoder(default=json_default, ensure_ascii=False, separators=(',', ':'))
+    return 'stdlib', lambda obj: encoder.encode(obj).encode('utf-8'), json.loads
+
+
+json_backend, _encode, _decode = select_json_backend(JSON_BACKEND)
+json_encode = metrics.timed('runequest_json_seconds', (('op', 'dumps'),))(_encode)
+json_decode = metrics.timed('runequest_json_seconds', (('op', 'loads'),))(_decode)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider on the selected backend; responses skip the str round trip."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return json_encode(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        return json_decode(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        return self._app.response_class(json_encode(self._prepare_response_obj(args, kwargs)), mimetype=self.mimetype)
+
+
 app = Flask(__name__, template_folder='templates')
+app.json = FastJSONProvider(app)
+
+def parse_user_id(value: Any) -> Optional[int]:
+    """User id from a query string or JSON body as an int, or None if it is not an integer."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            return None
+    return None
+
+@app.before_request
+def start_request():
+    g.request_start = time.perf_counter()
+    auction_house.start()
+    raw_user_id = request.args.get('user_id')
+    if raw_user_id is None and request.is_json:
+        body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            raw_user_id = body.get('user_id')
+    user_id = g.user_id = parse_user_id(raw_user_id)
+    log_context.set({
+        'request_id': request.headers.get('X-Request-ID') or os.urandom(8).hex(),
+        'user_id': user_id,
+        'route': request.url_rule.rule if request.url_rule else 'unmatched',
+        'method': request.method,
+    })
+    if metrics.enabled:
+        metrics.begin_request()
+    if raw_user_id is not None and user_id is None:
+        return jsonify({'error': 'Invalid user_id'}), 400
+    if RATE_LIMIT_ENABLED and user_id is not None:
+        allowed, retry_after = rate_limiter.allow(user_id, log_context.get()['route'])
+        if not allowed:
+            response = jsonify({'error': 'Too many requests'})
+            response.headers['Retry-After'] = str(math.ceil(retry_after))
+            return response, 429
+
+@app.after_request
+def finish_request(response):
+    context = log_context.get() or {}
+    if metrics.enabled:
+        metrics.end_request(context.get('route', 'unmatched'), request.method, response.status_code)
+    if 'request_id' in context:
+        response.headers['X-Request-ID'] = context['request_id']
+    duration_ms = round((time.perf_counter() - g.request_start) * 1000, 2) if 'request_start' in g else None
+    if response.status_code >= 500:
+        logger.warning("Request failed", extra={'status': response.status_code, 'duration_ms': duration_ms})
+    else:
+        logger.info("Request", extra={'status': response.status_code, 'duration_ms': duration_ms,
+                                      'sample_rate': LOG_ACCESS_SAMPLE_RATE})
+    return response
+
+@app.teardown_request
+def clear_request_context(exc):
+    log_context.set(None)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics/slow', methods=['GET'])
+def slow_requests():
+    if not ADMIN_TOKEN or request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(list(metrics.slow_samples))
+
 
 @app.route('/')
 def index():
@@ -341,12 +3025,16 @@ def index():
 
 @app.route('/api/classes', methods=['GET'])
 def get_classes():
-    return jsonify(CLASSES)
+    return static_catalog.response('classes')
+
+@app.route('/api/catalog', methods=['GET'])
+def get_catalog():
+    return static_catalog.response('catalog')
 
 @app.route('/api/create', methods=['POST'])
 def create():
     data = request.json
-    user_id = data.get('user_id')
+    user_id = g.user_id
     class_type = data.get('class')
     username = data.get('username', f'Player_{user_id}')
     
@@ -367,7 +3055,7 @@ def create():
 
 @app.route('/api/player', methods=['GET'])
 def get_player():
-    user_id = request.args.get('user_id', type=int)
+    user_id = g.user_id
     if not user_id:
         return jsonify({'error': 'Missing user_id'}), 400
     
@@ -380,79 +3068,174 @@ def get_player():
 
 @app.route('/api/items', methods=['GET'])
 def get_items():
-    return jsonify(ITEMS)
+    return static_catalog.response('items')
 
 @app.route('/api/buy-item', methods=['POST'])
 def buy_item():
     data = request.json
-    user_id = data.get('user_id')
+    user_id = g.user_id
     item_id = data.get('item_id')
     
-    player = Database.get_player(user_id)
-    if not player:
+    if not Database.player_exists(user_id):
         return jsonify({'error': 'Player not found'}), 404
     
-    item = None
-    for category in ITEMS.values():
-        for it in category:
-            if it['id'] == item_id:
-                item = it
-                break
-    
+    item = ITEM_INDEX.get(item_id) if isinstance(item_id, str) else None
     if not item:
         return jsonify({'error': 'Item not found'}), 404
     
-    if player['level'] < item.get('level_req', 0):
-        return jsonify({'error': f'Need level {item["level_req"]}'}), 400
+    result = Economy.buy_item(user_id, item)
+    if 'error' in result:
+        return jsonify(result), 400
+    return jsonify(result)
+
+@app.route('/api/auction', methods=['GET'])
+def auction_listings():
+    item_id = request.args.get('item_id')
+    max_price = request.args.get('max_price', type=int)
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(100, max(1, request.args.get('limit', 50, type=int)))
+    return jsonify(auction_house.browse(item_id, max_price, offset, limit))
+
+@app.route('/api/auction/search', methods=['GET'])
+def auction_search():
+    query = request.args.get('q', '').strip().lower()
+    max_price = request.args.get('max_price', type=int)
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(100, max(1, request.args.get('limit', 50, type=int)))
+    if not query:
+        return jsonify({'error': 'Missing q'}), 400
+    
+    item_ids = [item_id for item_id, item in ITEM_INDEX.items() if query in item_id or query in item['name'].lower()]
+    return jsonify(auction_house.search(item_ids, max_price, offset, limit))
+
+@app.route('/api/auction/list', methods=['POST'])
+def auction_list():
+    data = request.json
+    user_id = g.user_id
+    item_id = data.get('item_id')
+    price = data.get('price')
+    
+    if not isinstance(item_id, str) or item_id not in ITEM_INDEX:
+        return jsonify({'error': 'Item not found'}), 404
+    if isinstance(price, bool) or not isinstance(price, int) or not 0 < price <= SQL_INT_MAX:
+        return jsonify({'error': 'Invalid price'}), 400
     
-    if player['gold'] < item['price']:
-        return jsonify({'error': 'Not enough gold'}), 400
+    result = Economy.list_item(user_id, item_id, price)
+    if 'error' in result:
+        return jsonify(result), 400
+    return jsonify(result), 201
+
+@app.route('/api/auction/buy', methods=['POST'])
+def auction_buy():
+    data = request.json
+    listing_id = data.get('listing_id')
+    if isinstance(listing_id, bool) or not isinstance(listing_id, int) or not 0 < listing_id <= SQL_INT_MAX:
+        return jsonify({'error': 'Invalid listing_id'}), 400
     
-    player['gold'] -= item['price']
-    if item_id not in player['inventory']:
-        player['inventory'][item_id] = 0
-    player['inventory'][item_id] += 1
+    result = Economy.buy_listing(g.user_id, listing_id)
+    if 'error' in result:
+        return jsonify(result), 400
+    return jsonify(result)
+
+@app.route('/api/auction/cancel', methods=['POST'])
+def auction_cancel():
+    data = request.json
+    listing_id = data.get('listing_id')
+    if isinstance(listing_id, bool) or not isinstance(listing_id, int) or not 0 < listing_id <= SQL_INT_MAX:
+        return jsonify({'error': 'Invalid listing_id'}), 400
     
-    Database.save_player(user_id, player)
-    return jsonify({'success': True, 'gold': player['gold']})
+    result = Economy.cancel_listing(g.user_id, listing_id)
+    if 'error' in result:
+        return jsonify(result), 400
+    return jsonify(result)
 
 @app.route('/api/enemies', methods=['GET'])
 def get_enemies():
-    return jsonify(ENEMIES)
+    return static_catalog.response('enemies')
 
-@app.route('/api/attack', methods=['POST'])
-def attack():
+@app.route('/api/battle-start', methods=['POST'])
+def battle_start():
     data = request.json
-    user_id = data.get('user_id')
-    is_skill = data.get('is_skill', False)
+    user_id = g.user_id
+    enemy_id = data.get('enemy_id') or random.choice(list(ENEMIES))
+    
+    if enemy_id not in ENEMIES:
+        return jsonify({'error': 'Invalid enemy'}), 400
     
     player = Database.get_player(user_id)
     if not player:
         return jsonify({'error': 'Player not found'}), 404
     
-    player = CombatSystem.apply_equipment_bonuses(player)
+    session = battles.start(user_id, enemy_id, player)
+    return jsonify(session.to_dict())
+
+@app.route('/api/attack', methods=['POST'])
+def attack():
+    data = request.json
+    user_id = g.user_id
+    is_skill = data.get('is_skill', False)
+    if not isinstance(is_skill, bool):
+        return jsonify({'error': 'Invalid is_skill'}), 400
     
-    damage_result = CombatSystem.calculate_damage(player, {'defense': 5}, is_skill)
+    session = battles.get(user_id)
+    if not session:
+        return jsonify({'error': 'No active battle'}), 404
     
-    Database.save_player(user_id, player)
+    with session.lock:
+        if session.finished:
+            return jsonify({'error': 'Battle already finished'}), 409
+        if is_skill and not session.skill_ready:
+            return jsonify({'error': 'Not enough mana'}), 409
+        damage_result = session.attack(is_skill)
+        damage_result.update(session.to_dict())
     
     return jsonify(damage_result)
 
+@app.route('/api/flee', methods=['POST'])
+def flee():
+    user_id = g.user_id
+    
+    session = battles.get(user_id)
+    if not session:
+        return jsonify({'error': 'No active battle'}), 404
+    
+    with session.lock:
+        if session.finished:
+            return jsonify({'error': 'Battle already finished'}), 409
+        if random.random() > 0.3:
+            battles.finish(user_id)
+            return jsonify({'escaped': True})
+        result = {'escaped': False, 'enemy_damage': session.enemy_turn()}
+        result.update(session.to_dict())
+    
+    return jsonify(result)
+
 @app.route('/api/battle-end', methods=['POST'])
 def battle_end():
-    data = request.json
-    user_id = data.get('user_id')
-    enemy_name = data.get('enemy_name', 'Unknown')
-    won = data.get('won', False)
-    gold_gain = data.get('gold', 0)
-    exp_gain = data.get('exp', 0)
-    damage_dealt = data.get('damage_dealt', 0)
-    damage_taken = data.get('damage_taken', 0)
+    user_id = g.user_id
+    
+    session = battles.get(user_id)
+    if not session:
+        return jsonify({'error': 'No active battle'}), 404
+    
+    with session.lock:
+        if not session.finished:
+            return jsonify({'error': 'Battle not finished'}), 409
+        if battles.finish(user_id) is not session:
+            return jsonify({'error': 'No active battle'}), 404
+    
+    enemy_name = session.enemy['name']
+    won = session.won
+    gold_gain = session.enemy['gold'] if won else 0
+    exp_gain = session.enemy['exp'] if won else 0
+    damage_dealt = session.damage_dealt
+    damage_taken = session.damage_taken
     
     player = Database.get_player(user_id)
     if not player:
         return jsonify({'error': 'Player not found'}), 404
     
+    unlocked = []
     if won:
         player['gold'] += gold_gain
         player['exp'] += exp_gain
@@ -461,67 +3244,77 @@ def battle_end():
         player['total_exp'] += exp_gain
         player['damage_dealt'] += damage_dealt
         
-        # Check achievements
-        if player['kills'] == 1:
-            player['achievements']['first_kill'] = True
-        if player['kills'] == 100:
-            player['achievements']['hundred_kills'] = True
-        if player['gold'] >= 5000:
-            player['achievements']['rich'] = True
-        
-        # Update daily quests
-        if 'defeat_enemies' in player['daily_quests']:
-            player['daily_quests']['defeat_enemies']['progress'] += 1
-            if player['daily_quests']['defeat_enemies']['progress'] >= 5:
-                player['daily_quests']['defeat_enemies']['completed'] = True
-                player['gold'] += DAILY_QUESTS['defeat_enemies']['reward']
-        
-        if 'gain_exp' in player['daily_quests']:
-            player['daily_quests']['gain_exp']['progress'] += exp_gain
-            if player['daily_quests']['gain_exp']['progress'] >= 300:
-                player['daily_quests']['gain_exp']['completed'] = True
-                player['gold'] += DAILY_QUESTS['gain_exp']['reward']
+        unlocked += quest_engine.emit(player, 'kill', 1)
+        unlocked += quest_engine.emit(player, 'gold_gained', gold_gain)
+        unlocked += quest_engine.emit(player, 'exp_gained', exp_gain)
     else:
         player['battles_lost'] += 1
     
     player['health'] = player['max_health']
     
-    # Check level up
-    exp_needed = LEVEL_UP_EXP * player['level']
-    level_up = False
-    if player['exp'] >= exp_needed:
-        player['level'] += 1
-        player['exp'] -= exp_needed
-        player['max_health'] = int(player['max_health'] * BASE_STAT_MULTIPLIER)
-        player['max_mana'] = int(player['max_mana'] * BASE_STAT_MULTIPLIER)
-        player['attack'] = int(player['attack'] * BASE_STAT_MULTIPLIER)
-        player['defense'] = int(player['defense'] * BASE_STAT_MULTIPLIER)
-        player['health'] = player['max_health']
-        player['mana'] = player['max_mana']
-        level_up = True
-        
-        if player['level'] == 5:
-            player['achievements']['level_5'] = True
-        if player['level'] == 10:
-            player['achievements']['level_10'] = True
+    levels_gained = progression.resolve(player)
+    level_up = levels_gained > 0
+    if level_up:
+        unlocked += quest_engine.emit(player, 'level_up', levels_gained)
     
     Database.save_player(user_id, player)
+    battle_log.record(user_id, enemy_name, won, damage_dealt, damage_taken, int(time.time() - session.started_at))
     
-    return jsonify({'success': True, 'level_up': level_up, 'player': player})
+    return jsonify({'success': True, 'won': won, 'gold': gold_gain, 'exp': exp_gain, 'level_up': level_up,
+                    'levels_gained': levels_gained, 'unlocked': unlocked, 'player': player})
 
 @app.route('/api/leaderboard', methods=['GET'])
 def leaderboard():
-    leaders = Database.get_leaderboard(50)
+    board = request.args.get('board', 'level')
+    if board not in Leaderboard.BOARDS:
+        return jsonify({'error': 'Invalid board'}), 400
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(100, max(1, request.args.get('limit', 50, type=int)))
+    leaders = Database.get_leaderboard(limit, board, offset)
     return jsonify(leaders)
 
+@app.route('/api/leaderboard/rank', methods=['GET'])
+def leaderboard_rank():
+    user_id = g.user_id
+    board = request.args.get('board', 'level')
+    if not user_id:
+        return jsonify({'error': 'Missing user_id'}), 400
+    if board not in Leaderboard.BOARDS:
+        return jsonify({'error': 'Invalid board'}), 400
+    
+    rank = rankings.rank(user_id, board)
+    if rank is None:
+        return jsonify({'error': 'Player not found'}), 404
+    return jsonify({'user_id': user_id, 'board': board, 'rank': rank, 'total': rankings.size()})
+
+@app.route('/api/battles', methods=['GET'])
+def battle_history():
+    user_id = g.user_id
+    if not user_id:
+        return jsonify({'error': 'Missing user_id'}), 400
+    
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(100, max(1, request.args.get('limit', 20, type=int)))
+    return jsonify(Database.get_battles(user_id, limit, offset))
+
+@app.route('/api/admin/recompute-stats', methods=['POST'])
+def admin_recompute_stats():
+    if not ADMIN_TOKEN or request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    updated = progression.recompute_all()
+    logger.info(f"Recomputed progression for {updated} players")
+    return jsonify({'success': True, 'updated': updated})
+
 @app.route('/api/daily-quests', methods=['GET'])
 def get_daily_quests():
-    return jsonify(DAILY_QUESTS)
+    return static_catalog.response('daily_quests')
 
 @app.route('/api/achievements', methods=['GET'])
 def get_achievements():
-    return jsonify(ACHIEVEMENTS)
+    return static_catalog.response('achievements')
 
 if __name__ == '__main__':
     logger.info(f"Starting on port {PORT}")
+    auction_house.start()
     app.run(host='0.0.0.0', port=PORT, debug=False)